@@ -0,0 +1,5 @@
+'''Stand-in for stdeb used by the benchmarks.
+
+Only provides the sdist_dsc command, writing the debian source tree the way
+psa expects it, without calling any debian tool.
+'''
@@ -0,0 +1,115 @@
+'''Creates deb_dist/<package>-<version> with the unpacked source distribution
+and a debian folder built from setup.py and stdeb.cfg.'''
+
+import os
+import shutil
+import tarfile
+import time
+from ConfigParser import RawConfigParser
+from distutils.core import Command
+
+# stdeb.cfg fields written to the source and to the binary stanzas
+SOURCE_FIELDS = ['Section', 'XS-Python-Version']
+BINARY_FIELDS = ['Depends', 'Recommends', 'Suggests', 'Conflicts', 'Provides']
+
+
+def read_config(filename='stdeb.cfg'):
+    '''Returns the fields of the DEFAULT section of stdeb.cfg'''
+    parser = RawConfigParser()
+    parser.optionxform = str
+    parser.read(filename)
+
+    return parser.defaults()
+
+
+def format_description(short, text):
+    '''Formats a debian Description field'''
+    lines = [short]
+    for line in (text or short).strip().splitlines():
+        lines.append(' ' + (line.rstrip() or '.'))
+
+    return '\n'.join(lines)
+
+
+class sdist_dsc(Command):
+    description = 'create a debian source tree (benchmark stand-in)'
+
+    user_options = [
+        ('dist-dir=', 'd', 'directory of the debian source tree (default: deb_dist)'),
+        ('use-premade-distfile=', 'P', 'use this source tarball instead of running sdist'),
+    ]
+
+    def initialize_options(self):
+        self.dist_dir = None
+        self.use_premade_distfile = None
+
+    def finalize_options(self):
+        if self.dist_dir is None:
+            self.dist_dir = 'deb_dist'
+
+    def run(self):
+        config = read_config()
+        dist = self.distribution
+        package = config.get('Package', dist.get_name())
+        version = dist.get_version()
+
+        tarball = self.use_premade_distfile
+        if tarball is None:
+            self.run_command('sdist')
+            tarball = self.get_finalized_command('sdist').archive_files[0]
+
+        if not os.path.isdir(self.dist_dir):
+            os.makedirs(self.dist_dir)
+        shutil.copy(tarball, os.path.join(self.dist_dir, '%s_%s.orig.tar.gz' % (package, version)))
+
+        source = tarfile.open(tarball)
+        try:
+            topdir = source.getnames()[0].split('/')[0]
+            source.extractall(self.dist_dir)
+        finally:
+            source.close()
+
+        tree = os.path.join(self.dist_dir, '%s-%s' % (package, version))
+        if os.path.join(self.dist_dir, topdir) != tree:
+            os.rename(os.path.join(self.dist_dir, topdir), tree)
+
+        self.write_debian(os.path.join(tree, 'debian'), config, package, version)
+
+    def write_debian(self, debiandir, config, package, version):
+        dist = self.distribution
+        maintainer = '%s <%s>' % (dist.get_maintainer(), dist.get_maintainer_email())
+        os.makedirs(os.path.join(debiandir, 'source'))
+
+        source = ['Source: %s' % package, 'Maintainer: %s' % maintainer,
+                  'Priority: optional',
+                  'Build-Depends: python-all (>= 2.6.6-3), debhelper (>= 7)',
+                  'Standards-Version: 3.9.1']
+        source += ['%s: %s' % (name, config[name]) for name in SOURCE_FIELDS if name in config]
+
+        binary = ['Package: %s' % package, 'Architecture: all']
+        for name in BINARY_FIELDS:
+            value = config.get(name)
+            if name == 'Depends':
+                value = '${misc:Depends}, ${python:Depends}, ' + (value or '')
+            if value:
+                binary.append('%s: %s' % (name, value.strip().rstrip(',')))
+        binary += ['%s: %s' % item for item in sorted(config.items())
+                   if item[0].startswith('XB-') or item[0].startswith('XSBC-')]
+        binary.append('Description: ' + format_description(dist.get_description(),
+                                                          dist.get_long_description()))
+
+        with open(os.path.join(debiandir, 'control'), 'w') as handle:
+            handle.write('\n'.join(source) + '\n\n' + '\n'.join(binary) + '\n')
+
+        with open(os.path.join(debiandir, 'changelog'), 'w') as handle:
+            handle.write('%s (%s-1) unstable; urgency=low\n\n'
+                         '  * source package automatically created by stdeb\n\n'
+                         ' -- %s  %s\n' % (package, version, maintainer,
+                                           time.strftime('%a, %d %b %Y %H:%M:%S +0000',
+                                                         time.gmtime())))
+
+        with open(os.path.join(debiandir, 'compat'), 'w') as handle:
+            handle.write('7\n')
+
+        with open(os.path.join(debiandir, 'source', 'format'), 'w') as handle:
+            handle.write('3.0 (quilt)\n')
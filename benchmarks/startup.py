@@ -0,0 +1,107 @@
+'''Measures the startup time of each psa command.
+
+Every command is run several times in a scratch directory, with its own
+template index cache, and the best and median wall times are reported along
+with the time of a bare interpreter start for reference.
+
+Usage: python benchmarks/startup.py [--runs N] [--max-ms MS]
+'''
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+PSA = os.path.join(ROOT, 'psa')
+
+# (label, arguments, whether the command creates the benchmark project)
+COMMANDS = [
+    ('python', None, False),
+    ('--help', ['--help'], False),
+    ('list', ['list'], False),
+    ('init', ['init', 'benchproject', 'harmattan'], True),
+    ('update', ['update', '--app-name', 'Benchmark'], False),
+    ('build-deb --help', ['build-deb', '--help'], False),
+]
+
+
+def run(args, cwd, env):
+    '''Runs a command, returning its wall time in milliseconds'''
+    start = time.time()
+    proc = subprocess.Popen(args, cwd=cwd, env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, stderr = proc.communicate()
+    elapsed = (time.time() - start) * 1000
+
+    if proc.returncode:
+        raise RuntimeError('%s failed: %s' % (' '.join(args), stderr))
+
+    return elapsed
+
+
+def benchmark(runs):
+    '''Returns a list of (label, best, median) timings'''
+    path = tempfile.mkdtemp(prefix='psabench')
+    project_dir = os.path.join(path, 'benchproject')
+
+    env = dict(os.environ)
+    env.update(PSA_ROOT=ROOT, PSA_CACHE_DIR=os.path.join(path, 'cache'),
+               DEBFULLNAME='Benchmark', DEBEMAIL='benchmark@example.com')
+
+    results = []
+    try:
+        # Warm up the template index, like any psa run after the first one
+        run([sys.executable, PSA, 'list'], path, env)
+
+        for label, args, creates_project in COMMANDS:
+            if args is None:
+                args = [sys.executable, '-c', 'pass']
+            else:
+                args = [sys.executable, PSA] + args
+
+            cwd = project_dir if os.path.isdir(project_dir) and not creates_project else path
+
+            timings = []
+            for _ in range(runs):
+                if creates_project:
+                    shutil.rmtree(project_dir, ignore_errors=True)
+                timings.append(run(args, cwd, env))
+
+            timings.sort()
+            results.append((label, timings[0], timings[len(timings) // 2]))
+    finally:
+        shutil.rmtree(path)
+
+    return results
+
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-n', '--runs', dest='runs', type='int', default=10,
+                      help='Runs of each command')
+    parser.add_option('--max-ms', dest='max_ms', type='float',
+                      help='Fail if the median of a command exceeds the bare '
+                           'interpreter start by more than this')
+    options, _ = parser.parse_args()
+
+    results = benchmark(options.runs)
+    baseline = results[0][2]
+
+    print '%-20s %10s %10s %10s' % ('command', 'best ms', 'median ms', 'overhead')
+    failed = []
+    for label, best, median in results:
+        print '%-20s %10.1f %10.1f %10.1f' % (label, best, median, median - baseline)
+        if options.max_ms is not None and median - baseline > options.max_ms:
+            failed.append(label)
+
+    if failed:
+        sys.stderr.write('Startup regression in: %s\n' % ', '.join(failed))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,511 @@
+'''Benchmarks the init, render, hashing, package rewriting and build paths of
+psa.
+
+Synthetic projects and packages are generated in a scratch directory from a
+fixed seed: many small QML files plus a few large assets. The build pipeline
+runs with the stand-ins for stdeb, dpkg-buildpackage and fakeroot found in
+benchmarks/fakebin, so it works on a plain Linux box without network access
+nor debian tools.
+
+Every benchmark runs once to warm up and then --runs times, reporting the best
+and median wall times. Results saved with --output can be compared with a
+later run using --compare; they also record the sizes used, and comparisons
+between runs with different sizes are refused.
+
+Usage: python benchmarks/suite.py [options] [benchmark ...]
+'''
+
+import hashlib
+import imp
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+from contextlib import contextmanager
+from optparse import OptionParser
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+PSA = os.path.join(ROOT, 'psa')
+FAKEBIN = os.path.join(ROOT, 'benchmarks', 'fakebin')
+
+RESULTS_VERSION = 1
+
+# Changes smaller than this, in seconds, are noise and never reported
+NOISE_FLOOR = 0.001
+SEED = 2011
+SLUG = 'benchproject'
+
+sys.path.insert(0, os.path.join(ROOT, 'scripts'))
+import arfile
+import deb_add
+import refhashmake
+
+
+def load_psa():
+    '''Loads the psa script as a module, without writing a compiled file'''
+    dont_write_bytecode = sys.dont_write_bytecode
+    sys.dont_write_bytecode = True
+    try:
+        return imp.load_source('psa', PSA)
+    finally:
+        sys.dont_write_bytecode = dont_write_bytecode
+
+
+class NullStream(object):
+    '''Output stream discarding everything'''
+
+    def write(self, text):
+        pass
+
+
+@contextmanager
+def quiet():
+    '''Discards the output printed in the body of the with statement'''
+    stdout = sys.stdout
+    sys.stdout = NullStream()
+    try:
+        yield
+    finally:
+        sys.stdout = stdout
+
+
+def random_block(rng, size):
+    '''Returns size bytes of incompressible data derived from rng'''
+    seed = '%x' % rng.getrandbits(128)
+    chunks = []
+    for counter in xrange(size // 64 + 1):
+        chunks.append(hashlib.sha512('%s:%d' % (seed, counter)).digest())
+
+    return ''.join(chunks)[:size]
+
+
+def write_ar(filename, members):
+    '''Writes an ar archive with the given (name, data) members'''
+    with open(filename, 'wb') as handle:
+        handle.write(arfile.AR_MAGIC)
+        for name, data in members:
+            handle.write('%-16s%-12s%-6s%-6s%-8s%-10s`\n' %
+                         (name, 1300000000, 0, 0, 100644, len(data)))
+            handle.write(data)
+            if len(data) & 1:
+                handle.write('\n')
+
+
+class Workspace(object):
+    '''Scratch directory with the synthetic template, projects and packages'''
+
+    def __init__(self, config):
+        self.config = config
+        self.path = tempfile.mkdtemp(prefix='psabench')
+        self.rng = random.Random(SEED)
+
+        os.environ.update(PSA_ROOT=ROOT, PSA_CACHE_DIR=os.path.join(self.path, 'cache'),
+                          DEBFULLNAME='Benchmark', DEBEMAIL='benchmark@example.com')
+        self.psa = load_psa()
+
+        self.template_dir = os.path.join(self.path, 'templates', 'synthetic')
+        self.create_template()
+        self.template = self.psa.load_template_data(self.template_dir)
+        self.template.scan()
+
+        self.initdir = os.path.join(self.path, 'init')
+        self.builddir = os.path.join(self.path, 'build')
+        os.makedirs(self.initdir)
+        os.makedirs(self.builddir)
+        self.projectdir = self.init_project(self.builddir)
+
+        self.debfile = os.path.join(self.path, 'package.deb')
+        self.create_package()
+        self.arfile = os.path.join(self.path, 'members.a')
+        write_ar(self.arfile, [('member%d' % index, 'x' * (index % 512 + 1))
+                               for index in xrange(config['members'])])
+
+    def cleanup(self):
+        shutil.rmtree(self.path)
+
+    def create_template(self):
+        '''Copies the harmattan template, adding the synthetic files'''
+        shutil.copytree(os.path.join(ROOT, 'templates', 'harmattan'), self.template_dir)
+
+        with open(os.path.join(self.template_dir, 'setup.py.template'), 'r+b') as handle:
+            text = handle.read().replace("glob.glob('qml/*.qml')),",
+                                         "glob.glob('qml/*.qml')),\n"
+                                         "                  ('share/${PROJECT}/assets', "
+                                         "glob.glob('assets/*')),")
+            handle.seek(0)
+            handle.write(text)
+        with open(os.path.join(self.template_dir, 'MANIFEST.in.template'), 'ab') as handle:
+            handle.write('include assets/*\n')
+
+        for index in xrange(self.config['small_files']):
+            lines = ['// Page %d of ${PROJECT}, by ${MAINTAINER} <${EMAIL}>' % index,
+                     'import QtQuick 1.1', 'import com.nokia.meego 1.0', '',
+                     'Page {', '    id: page%d' % index]
+            while sum(len(line) + 1 for line in lines) < self.config['small_size']:
+                lines.append('    Label { text: "%s $$%d"; width: %d }' %
+                             ('${APPNAME}', self.rng.randint(0, 999), self.rng.randint(10, 800)))
+            lines.append('}')
+            with open(os.path.join(self.template_dir, 'qml',
+                                   'Page%04d.qml.template' % index), 'wb') as handle:
+                handle.write('\n'.join(lines) + '\n')
+
+        os.mkdir(os.path.join(self.template_dir, 'assets'))
+        for index in xrange(self.config['large_files']):
+            with open(os.path.join(self.template_dir, 'assets',
+                                   'asset%d.jpg.template' % index), 'wb') as handle:
+                handle.write(random_block(self.rng, self.config['large_size']))
+
+    def create_builder(self):
+        return self.psa.create_builder(self.template)
+
+    def init_project(self, directory):
+        '''Creates the benchmark project in directory'''
+        current_dir = os.getcwd()
+        os.chdir(directory)
+        try:
+            builder = self.create_builder()
+            builder.init(SLUG, ['init', SLUG, 'synthetic'])
+        finally:
+            os.chdir(current_dir)
+
+        with open(os.path.join(builder.projectdir, SLUG + '.aegis'), 'wb') as handle:
+            handle.write(random_block(self.rng, 2048))
+
+        return builder.projectdir
+
+    def create_package(self):
+        '''Writes a package with the project files as data'''
+        def package_path(relpath):
+            return './usr/share/%s/%s' % (SLUG, relpath)
+
+        data = os.path.join(self.path, 'data.tar.gz')
+        tar = tarfile.open(data, 'w:gz', compresslevel=1)
+        for filename in self.project_files():
+            tar.add(filename, package_path(os.path.relpath(filename, self.projectdir)))
+        tar.close()
+
+        self.controlfile = os.path.join(self.path, 'control.tar.gz')
+        tar = tarfile.open(self.controlfile, 'w:gz')
+        tar.add(os.path.join(self.projectdir, 'stdeb.cfg'), './control')
+        tar.close()
+
+        with open(data, 'rb') as handle:
+            with open(self.controlfile, 'rb') as control:
+                write_ar(self.debfile, [('debian-binary', '2.0\n'),
+                                        ('control.tar.gz', control.read()),
+                                        ('data.tar.gz', handle.read())])
+        os.remove(data)
+
+    def project_files(self):
+        '''Returns the files of the benchmark project, sorted'''
+        filenames = []
+        for root, dirnames, names in os.walk(self.projectdir):
+            dirnames[:] = sorted(name for name in dirnames if name != 'deb_dist')
+            filenames.extend(os.path.join(root, name) for name in sorted(names))
+
+        return filenames
+
+    def build_env(self):
+        '''Returns the environment of psa processes using the stand-ins'''
+        env = dict(os.environ)
+        env['PATH'] = FAKEBIN + os.pathsep + env.get('PATH', '')
+        env['PYTHONPATH'] = FAKEBIN + os.pathsep + env.get('PYTHONPATH', '')
+        env['PSA_TEMPLATE_PATH'] = os.path.dirname(self.template_dir)
+        return env
+
+    def run_psa(self, args, cwd):
+        '''Runs a psa command with the stand-ins, returning its wall time'''
+        start = time.time()
+        proc = subprocess.Popen([sys.executable, PSA] + args, cwd=cwd, env=self.build_env(),
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = proc.communicate()
+        elapsed = time.time() - start
+
+        if proc.returncode:
+            raise RuntimeError('psa %s failed: %s%s' % (' '.join(args), stdout, stderr))
+
+        return elapsed
+
+
+# Benchmarks. Each one prepares its inputs and returns the wall time of the
+# measured operation.
+
+def bench_init(workspace):
+    '''copy_template_files and render of a new project'''
+    shutil.rmtree(os.path.join(workspace.initdir, SLUG), ignore_errors=True)
+    workspace.psa.COMPILED_TEMPLATES.clear()
+    builder = workspace.create_builder()
+
+    current_dir = os.getcwd()
+    os.chdir(workspace.initdir)
+    try:
+        start = time.time()
+        builder.init(SLUG, ['init', SLUG, 'synthetic'])
+        return time.time() - start
+    finally:
+        os.chdir(current_dir)
+
+
+def bench_process(workspace):
+    '''process of fresh copies of the QML templates, in place'''
+    builder = workspace.create_builder()
+    builder.fill_info(workspace.psa.get_local_config(workspace.projectdir),
+                      workspace.projectdir)
+
+    processdir = os.path.join(workspace.path, 'process')
+    shutil.rmtree(processdir, ignore_errors=True)
+    shutil.copytree(os.path.join(workspace.template_dir, 'qml'), processdir)
+    filenames = [os.path.join(processdir, name) for name in sorted(os.listdir(processdir))]
+    workspace.psa.COMPILED_TEMPLATES.clear()
+
+    start = time.time()
+    for filename in filenames:
+        builder.process(filename)
+    return time.time() - start
+
+
+def hash_options():
+    options, _ = refhashmake.parse_args(['-c', '-a', '-b', '-o', 'com.nokia.maemo', '-r', '-f'])
+    return options
+
+
+def bench_hash(workspace):
+    '''refhashmake of the project files, without cache'''
+    filenames = workspace.project_files()
+
+    start = time.time()
+    refhashmake.process_files(filenames, hash_options(), NullStream())
+    return time.time() - start
+
+
+def bench_hash_cached(workspace):
+    '''refhashmake of the project files, with a warm digest cache'''
+    filenames = workspace.project_files()
+    cache = refhashmake.DigestCache(os.path.join(workspace.path, 'digests'))
+    refhashmake.process_files(filenames, hash_options(), NullStream(), cache)
+
+    start = time.time()
+    refhashmake.process_files(filenames, hash_options(), NullStream(), cache)
+    return time.time() - start
+
+
+def copy_package(workspace):
+    debfile = os.path.join(workspace.path, 'work.deb')
+    shutil.copy(workspace.debfile, debfile)
+    return debfile
+
+
+def bench_deb_append(workspace):
+    '''deb_add of a new member, appended to a copy of the package'''
+    debfile = copy_package(workspace)
+    aegis = os.path.join(workspace.projectdir, SLUG + '.aegis')
+
+    with quiet():
+        start = time.time()
+        deb_add.apply_changes(debfile, [(aegis, '_aegis')])
+        return time.time() - start
+
+
+def bench_deb_replace(workspace):
+    '''deb_add replacing the control member, rewriting the package'''
+    debfile = copy_package(workspace)
+
+    with quiet():
+        start = time.time()
+        deb_add.apply_changes(debfile, [(workspace.controlfile, 'control.tar.gz')])
+        return time.time() - start
+
+
+def bench_ar_parse(workspace):
+    '''ArFile index of an archive with many members'''
+    start = time.time()
+    with arfile.ArFile(workspace.arfile) as archive:
+        for member in archive.members:
+            archive.read(member)
+    return time.time() - start
+
+
+def bench_build(workspace):
+    '''psa build-deb --force of the project, with the stand-ins'''
+    return workspace.run_psa(['build-deb', '--force'], workspace.projectdir)
+
+
+def bench_build_fast(workspace):
+    '''psa build-deb --fast --force of the project'''
+    return workspace.run_psa(['build-deb', '--fast', '--force'], workspace.projectdir)
+
+
+def bench_build_fast_dev(workspace):
+    '''psa build-deb --fast --force --compression-profile dev of the project'''
+    return workspace.run_psa(['build-deb', '--fast', '--force', '--compression-profile', 'dev'],
+                             workspace.projectdir)
+
+
+def bench_build_fast_release(workspace):
+    '''psa build-deb --fast --force --compression-profile release of the project'''
+    return workspace.run_psa(['build-deb', '--fast', '--force', '--compression-profile', 'release'],
+                             workspace.projectdir)
+
+
+def bench_build_unchanged(workspace):
+    '''psa build-deb of an unchanged project, with the stand-ins'''
+    return workspace.run_psa(['build-deb'], workspace.projectdir)
+
+
+BENCHMARKS = [
+    ('init', bench_init),
+    ('process', bench_process),
+    ('hash', bench_hash),
+    ('hash-cached', bench_hash_cached),
+    ('deb-append', bench_deb_append),
+    ('deb-replace', bench_deb_replace),
+    ('ar-parse', bench_ar_parse),
+    ('build', bench_build),
+    ('build-fast', bench_build_fast),
+    ('build-fast-dev', bench_build_fast_dev),
+    ('build-fast-release', bench_build_fast_release),
+    ('build-unchanged', bench_build_unchanged),
+]
+
+
+def run_benchmarks(names, config, runs):
+    '''Returns the results of the benchmarks with the given names'''
+    results = {'version': RESULTS_VERSION,
+               'config': config,
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'cpus': os.sysconf('SC_NPROCESSORS_ONLN'),
+               'started': time.time(),
+               'benchmarks': {}}
+
+    workspace = Workspace(config)
+    try:
+        for name, function in BENCHMARKS:
+            if names and name not in names:
+                continue
+
+            function(workspace)
+            timings = sorted(function(workspace) for _ in xrange(runs))
+            results['benchmarks'][name] = {'best': timings[0],
+                                           'median': timings[len(timings) // 2],
+                                           'runs': timings}
+            print '%-18s %10.2f %10.2f  %s' % (name, timings[0] * 1000,
+                                               timings[len(timings) // 2] * 1000,
+                                               function.__doc__)
+            sys.stdout.flush()
+    finally:
+        workspace.cleanup()
+
+    return results
+
+
+def format_config(config):
+    return ', '.join('%s=%s' % item for item in sorted(config.items()))
+
+
+def compare(baseline, results, threshold):
+    '''Prints the change of the median of every benchmark since the baseline.
+
+    Returns the names of the benchmarks slower than threshold percent.
+    '''
+    if baseline['config'] != results['config']:
+        raise ValueError('The results were measured with different sizes: %s and %s' %
+                         (format_config(baseline['config']), format_config(results['config'])))
+
+    print '%-18s %10s %10s %8s' % ('benchmark', 'base ms', 'median ms', 'change')
+    slower = []
+    for name in sorted(results['benchmarks']):
+        current = results['benchmarks'][name]['median']
+        if name not in baseline['benchmarks']:
+            print '%-18s %10s %10.2f' % (name, '-', current * 1000)
+            continue
+
+        base = baseline['benchmarks'][name]['median']
+        change = (current - base) * 100.0 / base if base else 0.0
+        flag = ''
+        if change > threshold and current - base > NOISE_FLOOR:
+            slower.append(name)
+            flag = '  SLOWER'
+        print '%-18s %10.2f %10.2f %+7.1f%%%s' % (name, base * 1000, current * 1000,
+                                                 change, flag)
+
+    return slower
+
+
+def load_results(filename):
+    with open(filename, 'rb') as handle:
+        results = json.load(handle)
+    if results.get('version') != RESULTS_VERSION:
+        raise ValueError('%s has an unsupported format' % filename)
+    return results
+
+
+def main():
+    parser = OptionParser(usage='%prog [options] [benchmark ...]')
+    parser.add_option('-n', '--runs', dest='runs', type='int', default=5,
+                      help='Runs of each benchmark, after a warm up run')
+    parser.add_option('--small-files', dest='small_files', type='int', default=500,
+                      help='Number of small QML files in the project')
+    parser.add_option('--small-size', dest='small_size', type='int', default=2048,
+                      help='Size in bytes of the small files')
+    parser.add_option('--large-files', dest='large_files', type='int', default=4,
+                      help='Number of large assets in the project')
+    parser.add_option('--large-size', dest='large_size', type='int', default=4 << 20,
+                      help='Size in bytes of the large assets')
+    parser.add_option('--members', dest='members', type='int', default=2000,
+                      help='Number of members of the archive parsed by ar-parse')
+    parser.add_option('-o', '--output', dest='output',
+                      help='Write the results to this JSON file')
+    parser.add_option('-c', '--compare', dest='compare',
+                      help='Compare the results with the ones saved in this file')
+    parser.add_option('--results', dest='results',
+                      help='Compare these saved results instead of running the benchmarks')
+    parser.add_option('-t', '--threshold', dest='threshold', type='float', default=10.0,
+                      help='Slowdown, in percent, reported by --compare')
+    parser.add_option('-l', '--list', dest='list', action='store_true',
+                      help='List the benchmarks')
+    options, names = parser.parse_args()
+
+    if options.list:
+        for name, function in BENCHMARKS:
+            print '%-18s %s' % (name, function.__doc__)
+        return
+
+    unknown = set(names) - set(name for name, _ in BENCHMARKS)
+    if unknown:
+        parser.error('Unknown benchmarks: %s' % ', '.join(sorted(unknown)))
+
+    if options.results:
+        results = load_results(options.results)
+    else:
+        config = dict((key, getattr(options, key)) for key in
+                      ['small_files', 'small_size', 'large_files', 'large_size', 'members'])
+
+        print '%-18s %10s %10s' % ('benchmark', 'best ms', 'median ms')
+        results = run_benchmarks(names, config, options.runs)
+
+        if options.output:
+            with open(options.output, 'wb') as handle:
+                json.dump(results, handle, indent=2, sort_keys=True)
+
+    if options.compare:
+        print
+        try:
+            slower = compare(load_results(options.compare), results, options.threshold)
+        except ValueError, error:
+            sys.stderr.write('%s\n' % error)
+            sys.exit(2)
+
+        if slower:
+            sys.stderr.write('Slower than the baseline: %s\n' % ', '.join(slower))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
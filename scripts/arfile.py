@@ -0,0 +1,271 @@
+#!/usr/bin/python
+# This file is part of the PySide project.
+#
+# Copyright (C) 2011 Nokia Corporation and/or its subsidiary(-ies).
+#
+# Contact: PySide team <contact@pyside.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# version 2 as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301 USA
+
+''' arfile - Reads ar archives (e.g. debian packages).
+
+The archive is mapped in memory and its headers are scanned once, building an
+index of the members. Their contents are served as buffers over the mapping,
+without copying them.
+
+Usage: arfile.py <archive> [<member> ...]
+'''
+
+import mmap
+import os
+import sys
+
+AR_MAGIC = '!<arch>\n'
+AR_HEADER_SIZE = 60
+
+# ar_name[16];    +00
+# ar_date[12];    +16 (= seconds since)
+# ar_uid[6]       +28 (= "0     ")
+# ar_gid[6]       +34 (= "0     ")
+# ar_mode[8]      +40 (= "100644  ")
+# ar_size[10];    +48
+# ar_fmag[2];     +58 (= "`\n")
+# -------------------
+#                 =60
+
+# Special members of GNU archives: the symbol table and the long names table
+SYMBOL_TABLES = ('/', '/SYM64/')
+LONG_NAMES = '//'
+
+
+class ArMember(object):
+    '''Entry of the ar archive index'''
+
+    __slots__ = ['name', 'header', 'offset', 'size', 'mtime', 'uid', 'gid', 'mode']
+
+    def __init__(self, name, header, offset):
+        self.name = name
+        self.header = header
+        self.offset = offset
+        self.size = int(header[48:58])
+        self.mtime = int(header[16:28].strip() or 0)
+        self.uid = int(header[28:34].strip() or 0)
+        self.gid = int(header[34:40].strip() or 0)
+        self.mode = int(header[40:48].strip() or '0', 8)
+
+    def __repr__(self):
+        return '<ArMember %s at %d, %d bytes>' % (self.name, self.offset, self.size)
+
+
+class MemberFile(object):
+    '''Read-only file object over a single member of an ar archive'''
+
+    def __init__(self, archive, member):
+        self.archive = archive
+        self.member = member
+        self.name = member.name
+        self.position = 0
+
+    def read(self, size=-1):
+        remaining = self.member.size - self.position
+        if size < 0 or size > remaining:
+            size = remaining
+        start = self.member.offset + self.position
+        self.position += size
+        return self.archive.map[start:start + size]
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += self.member.size
+        self.position = max(0, min(offset, self.member.size))
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        pass
+
+
+class ArFile(object):
+    '''Indexed ar archive.
+
+    members - list of ArMember for the regular members, in archive order
+    entries - list of ArMember for every header, including the GNU symbol
+              and long names tables
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.map = None
+        self.entries = []
+        self.members = []
+        self.index = {}
+
+        with open(filename, 'rb') as handle:
+            if os.fstat(handle.fileno()).st_size < len(AR_MAGIC):
+                raise ValueError('%s is not an ar archive' % filename)
+            self.map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.map[:len(AR_MAGIC)] != AR_MAGIC:
+            self.close()
+            raise ValueError('%s is not an ar archive' % filename)
+
+        try:
+            self.scan()
+        except ValueError:
+            self.close()
+            raise
+
+    def scan(self):
+        '''Builds the member index from the headers'''
+        long_names = None
+        position = len(AR_MAGIC)
+        end = len(self.map)
+
+        while position + AR_HEADER_SIZE <= end:
+            header = self.map[position:position + AR_HEADER_SIZE]
+            if header[58:60] != '`\n':
+                raise ValueError('Bad ar header in %s at %d' % (self.filename, position))
+
+            name = header[:16].rstrip()
+            member = ArMember(name, header, position + AR_HEADER_SIZE)
+            if member.offset + member.size > end:
+                raise ValueError('Truncated member %s in %s' % (name, self.filename))
+
+            if name == LONG_NAMES:
+                long_names = self.map[member.offset:member.offset + member.size]
+            elif name not in SYMBOL_TABLES:
+                if name.startswith('/') and name[1:].isdigit():
+                    # GNU long name, stored in the long names table
+                    if long_names is None:
+                        raise ValueError('Missing long names table in %s' % self.filename)
+                    start = int(name[1:])
+                    name = long_names[start:long_names.index('/\n', start)]
+                elif name.endswith('/'): # Strip GNU extensions
+                    name = name[:-1]
+
+                member.name = name
+                self.members.append(member)
+                self.index.setdefault(name, member)
+
+            self.entries.append(member)
+
+            # Members are aligned to even offsets
+            position = member.offset + member.size + (member.size & 1)
+
+    def close(self):
+        '''Releases the mapping of the archive'''
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def getnames(self):
+        '''Returns the names of the members'''
+        return [member.name for member in self.members]
+
+    def getmember(self, name):
+        '''Returns the ArMember named 'name' '''
+        try:
+            return self.index[name]
+        except KeyError:
+            raise KeyError('%s not found in %s' % (name, self.filename))
+
+    def find(self, prefix):
+        '''Returns the first ArMember whose name starts with prefix, or None'''
+        for member in self.members:
+            if member.name.startswith(prefix):
+                return member
+        return None
+
+    def read(self, member):
+        '''Returns a buffer with the contents of member, given by name or as
+        an ArMember. The buffer is only valid while the archive is open.'''
+        if not isinstance(member, ArMember):
+            member = self.getmember(member)
+        return buffer(self.map, member.offset, member.size)
+
+    def open(self, member):
+        '''Returns a read-only file object for member, given by name or as
+        an ArMember'''
+        if not isinstance(member, ArMember):
+            member = self.getmember(member)
+        return MemberFile(self, member)
+
+    def extract(self, member, targetdir=None):
+        '''Writes member, given by name or as an ArMember, to targetdir'''
+        if not isinstance(member, ArMember):
+            member = self.getmember(member)
+
+        filename = os.path.join(targetdir or os.curdir, member.name)
+        with open(filename, 'wb') as output:
+            output.write(self.read(member))
+
+        return filename
+
+
+def is_arfile(archive):
+    '''Checks if archive starts with the ar magic number'''
+    with open(archive, 'rb') as handle:
+        return handle.read(len(AR_MAGIC)) == AR_MAGIC
+
+
+def get_members(archive):
+    '''Gets a list of all members of this archive'''
+
+    if not is_arfile(archive):
+        return []
+
+    with ArFile(archive) as arfile:
+        return arfile.getnames()
+
+
+def extract(archive, name=None, targetdir=None):
+    '''Extract all files or just 'name' from 'archive' into targetdir'''
+
+    with ArFile(archive) as arfile:
+        if name:
+            arfile.extract(name, targetdir)
+        else:
+            for member in arfile.members:
+                arfile.extract(member, targetdir)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print >> sys.stderr, __doc__.strip()
+        sys.exit(1)
+
+    try:
+        with ArFile(sys.argv[1]) as arfile:
+            if len(sys.argv) == 2:
+                for member in arfile.members:
+                    print '%-16s %10d %o' % (member.name, member.size, member.mode)
+            for name in sys.argv[2:]:
+                arfile.extract(name)
+    except (KeyError, ValueError, EnvironmentError), error:
+        print >> sys.stderr, error
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
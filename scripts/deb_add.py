@@ -20,26 +20,46 @@
 # 02110-1301 USA
 
 ''' deb-add - Python port of the Perl script with a similar name that
-adds/replaces files in binary debian packages.'''
+adds/replaces files in binary debian packages.
+
+Usage: deb_add.py [-r <member>] <debfile> [<source>=<target> ...]
+       deb_add.py -c <control> [-r <member>] [<source>=<target> ...]
+'''
 
 import sys
 import os
 import re
 import logging
+import shutil
 import stat
+import tempfile
 from optparse import OptionParser
 
-def parse_args():
-    '''Parse command line options from sys.argv'''
-    parser = OptionParser()
+from arfile import ArFile, AR_MAGIC
+
+# Members are copied through a buffer of this size, so the memory used
+# doesn't depend on the size of the package.
+BUFFER_SIZE = 256*1024
+
+def parse_args(argv=None):
+    '''Parse command line options from argv, sys.argv by default'''
+    parser = OptionParser(usage='%prog [options] [<debfile>] [<source>=<target> ...]')
 
     parser.add_option('-c', '--control', dest='control',
                       help='Control file for reading.',
                       action='store', type='string')
 
-    parser.set_defaults(control='', verbose=False)
+    parser.add_option('-r', '--remove', dest='removals',
+                      help='Member to remove from the package. Can be repeated.',
+                      action='append', type='string')
+
+    parser.add_option('-v', '--verbose', dest='verbose',
+                      help='Output debug messages',
+                      action='store_true')
 
-    return parser.parse_args()
+    parser.set_defaults(control='', removals=[], verbose=False)
+
+    return parser.parse_args(argv)
 
 def parse_control(control):
     '''Get name, version and arch from a debian control file'''
@@ -70,109 +90,175 @@ def parse_control(control):
     return name, version, arch
 
 
-def replace_files(newdeb, debfile, changes, control):
-    '''Replace or copy the existing files in the debian archive'''
-    name = control[0]
-    to_remove = []
+def copy_data(source, target, size):
+    '''Copies size bytes from the source file object to the target one,
+    using a bounded buffer.
 
-    with open(debfile, 'rb') as deb:
+    Returns the number of bytes copied, which is less than size only if
+    the source ended before.
+    '''
+    copied = 0
+    while copied < size:
+        buf = source.read(min(BUFFER_SIZE, size - copied))
+        if not buf:
+            break
+        target.write(buf)
+        copied += len(buf)
 
-        # magic:
-        magic = '!<arch>\n'
-        debmagic = deb.read(8)
+    return copied
 
-        if debmagic != magic:
-            logging.critical("File %s does not have .deb magic number", debfile)
-            sys.exit(1)
 
-        newdeb.write(magic)
-
-        # ar_name[16];    +00
-        # ar_date[12];    +16 (= seconds since)
-        # ar_uid[6]       +28 (= "0     ")
-        # ar_gid[6]       +34 (= "0     ")
-        # ar_mode[8]      +40 (= "100644  ")
-        # ar_size[10];    +48
-        # ar_fmag[2];     +58 (= "`\n")
-        # -------------------
-        #                 =60
-
-        # List existing files that could be replaced.
-        while 1:
-            header = deb.read(60)
-            if len(header) <= 0:
-                break
-            member = header[:16]
-            size = int(header[48:58])
-            if size & 1:
-                size += 1
-
-            if header[58:60] != '`\n':
-                logging.warning('Bad AR header.')
-                break # We're done with the existing files.
+def file_info(abs_source, target):
+    '''Returns the (source file, last modification time, size in bytes,
+    target file) tuple describing a new member'''
+    st = os.stat(abs_source)
+
+    return (abs_source, st[stat.ST_MTIME], st[stat.ST_SIZE], target)
+
+
+def write_member(newdeb, info, header=None):
+    '''Writes the header and contents of a file to the debian archive.
+
+    info - (source file, last modification time, size in bytes, target file)
+    header - header of the member being replaced. Its owner and mode are
+             kept. New members are owned by root with mode 100644.
+    '''
+    source, mtime, newsize, target = info
+
+    if header is None:
+        newhdr = "%-16s%-12s%-6s%-6s%-8s%-10s`\n"
+        newhdr %= (target, mtime, '0', '0', '100644', newsize)
+    else:
+        newhdr = header[:16] + '%-12s' % mtime + header[28:48] + \
+                 '%-10s' % newsize + header[58:]
+
+    newdeb.write(newhdr)
+    with open(source, 'rb') as temp:
+        if copy_data(temp, newdeb, newsize) != newsize:
+            raise ValueError('Failed to read %s fully' % source)
+    if newsize & 1:
+        newdeb.write('\n')
+
+
+def replace_files(newdeb, debfile, changes, removals=()):
+    '''Replace, remove or copy the existing files in the debian archive.
+
+    changes - dict with the infos of the new files, keyed by target name
+    removals - names of the members left out
+
+    Returns the names of the replaced members.
+    '''
+    replaced = []
+
+    with ArFile(debfile) as deb:
+
+        newdeb.write(AR_MAGIC)
+
+        for member in deb.entries:
 
             # Should we replace it?
-            if member.strip() in changes:
-                source, mtime, newsize, target = changes[member.strip()]
-                to_remove.append(member.strip())
-
-                print 'Replacing', member
-
-                header = header[:16] + '%-12s' % mtime + header[16+12:]
-                header = header[:48] + '%-10s' % newsize + header[48+10:]
-                newdeb.write(header)
-                with open(source, 'rb') as temp:
-                    buf = temp.read(newsize)
-                    if len(buf) != newsize:
-                        logging.critical('Failed to read %s fully', source)
-                        sys.exit(0)
-                    newdeb.write(buf)
-                if newsize & 1:
+            if member.name in changes:
+                replaced.append(member.name)
+
+                print 'Replacing', member.name
+
+                write_member(newdeb, changes[member.name], member.header)
+            elif member.name in removals:
+                print 'Removing', member.name
+            else:
+                newdeb.write(member.header)
+                newdeb.write(deb.read(member))
+                if member.size & 1:
                     newdeb.write('\n')
 
-            newdeb.write(header)
-            newdeb.write(deb.read(size))
-
-    # Update files dict to avoid files being added again.
-    for name in to_remove:
-        del changes[name]
+    return replaced
 
 
 def add_files(newdeb, files):
-    '''Add new files to the debian archive.'''
+    '''Add new files to the debian archive, in the order of the files list.'''
+
+    for info in files:
+        print 'Inserting', info[3]
+        write_member(newdeb, info)
+
+
+def append_files(newdeb, debfile, files):
+    '''Copies the debian archive as is and appends new files at its end.
+
+    The existing members are copied as a single block, without being
+    parsed or rewritten one by one.
+    '''
+    with open(debfile, 'rb') as deb:
+        size = os.fstat(deb.fileno()).st_size
+        if size & 1:
+            raise ValueError('Bad AR archive')
+        if copy_data(deb, newdeb, size) != size:
+            raise ValueError('Failed to read %s fully' % debfile)
+
+    add_files(newdeb, files)
+
+
+def apply_changes(abs_debfile, changes=(), removals=()):
+    '''Adds, replaces and removes members of a debian package in one pass.
+
+    abs_debfile - debian package to be modified.
+    changes - list of (absolute source file, target name) pairs. Existing
+              members are replaced where they are, the other ones are
+              appended in the given order.
+    removals - names of the members to remove.
+
+    The new package is written next to the original one and renamed over
+    it, so it is never left half written, even if the process is killed.
+    When files are only added, the original package is copied as a block
+    and the files are appended to the copy.
+
+    Raises ValueError for invalid changes or packages.
+    '''
+    files = []
+    for abs_source, target in changes:
+        validate_file(abs_source, target)
+        files.append(file_info(abs_source, target))
+
+    changed = dict((info[3], info) for info in files)
+    removals = set(removals)
+
+    if len(changed) != len(files):
+        raise ValueError('Target files must be unique')
+
+    if removals & set(changed):
+        raise ValueError('Members %s are both changed and removed' %
+                         ', '.join(sorted(removals & set(changed))))
+
+    with ArFile(abs_debfile) as deb:
+        members = set(deb.getnames())
+
+    if removals - members:
+        raise ValueError('Members %s not found in %s' %
+                         (', '.join(sorted(removals - members)), abs_debfile))
+
+    fd, abs_newfile = tempfile.mkstemp(prefix=os.path.basename(abs_debfile) + '.',
+                                       dir=os.path.dirname(os.path.abspath(abs_debfile)))
+    try:
+        with os.fdopen(fd, 'wb') as newdeb:
+            if not removals and not members & set(changed):
+                append_files(newdeb, abs_debfile, files)
+            else:
+                replaced = replace_files(newdeb, abs_debfile, changed, removals)
+                add_files(newdeb, [info for info in files if info[3] not in replaced])
+
+        shutil.copymode(abs_debfile, abs_newfile)
+        os.rename(abs_newfile, abs_debfile)
+    except:
+        os.remove(abs_newfile)
+        raise
 
-    for name, info in files.items():
-        print 'Inserting', name
-        if not info[3]:
-            continue
-        newsize = info[2]
-        newhdr = "%-16s%-12s%-6s%-6s%-8s%-10s`\n"
-        newhdr %= (info[3],
-                        info[1],
-                        '0',
-                        '0',
-                        '100644',
-                        info[2])
-
-        newdeb.write(newhdr)
-        with open(info[0], 'rb') as temp:
-            buf = temp.read(newsize)
-            if len(buf) != newsize:
-                logging.critical('Failed to read %s fully', info[0])
-                sys.exit(1)
-            newdeb.write(buf)
-        if newsize & 1:
-            newdeb.write('\n')
 
 def process_args(args):
     '''Process the arguments with the file pairs
-    Return a dict of tuples.
-
-    Key: target file in the deb archive
-    Values: (source file, last modification time, size in bytes, target file.
+    Return a list of (source file, target file) tuples.
     '''
 
-    files = {}
+    files = []
 
     for arg in args:
         try:
@@ -181,17 +267,7 @@ def process_args(args):
             logging.critical('Filenames must be <source>=<target>')
             sys.exit(1)
 
-        if not (os.path.exists(source) and os.path.isfile(source)):
-            logging.critical('Source file must be a regular file')
-            sys.exit(1)
-
-        if len(target) > 16:
-            logging.critical('Target file must be at most 16 characters')
-            sys.exit(1)
-
-        st = os.stat(source)
-
-        files[target] = (source, st[stat.ST_MTIME], st[stat.ST_SIZE], target)
+        files.append((os.path.abspath(source), target))
 
     return files
 
@@ -218,24 +294,14 @@ def add(abs_source, target, abs_control, abs_debfile):
     abs_control - control file of this package
     abs_debfile - debian package to be modified.
 
-    This function copies the original debian package to abs_debfile.orig
+    See apply_changes.
     '''
 
     logging.info('Adding %s as %s to abs_debfile %s with abs_control %s', abs_source, target, abs_debfile, abs_control)
 
-    control_data = parse_control(abs_control)
-    validate_file(abs_source, target)
+    parse_control(abs_control)
 
-    st = os.stat(abs_source)
-
-    files = {target : (abs_source, st[stat.ST_MTIME], st[stat.ST_SIZE], target)}
-
-    with open(abs_debfile+'.new', 'wb') as newdeb:
-        replace_files(newdeb, abs_debfile, files, control_data)
-        add_files(newdeb, files)
-
-    os.rename(abs_debfile, abs_debfile + '.orig')
-    os.rename(abs_debfile + '.new', abs_debfile)
+    apply_changes(abs_debfile, [(abs_source, target)])
 
 
 def main():
@@ -248,27 +314,24 @@ def main():
     if options.control:
         name, version, arch = parse_control(options.control)
 
-        control = name, version, arch
         debfile = '%s_%s_%s.deb' % (name, version, arch)
     else:
         if not args:
             logging.critical('Must provide a control or debian file.')
             sys.exit(1)
-        debfile = args[0]
+        debfile = args.pop(0)
 
     files = process_args(args)
 
-    if not files:
+    if not files and not options.removals:
         logging.warning('No files to be injected. Exiting')
         sys.exit(0)
 
-    with open(debfile+'.new', 'wb') as newdeb:
-
-        replace_files(newdeb, debfile, files, control)
-
-        add_files(newdeb, files)
-
-    os.rename(debfile+'.new', debfile)
+    try:
+        apply_changes(debfile, files, options.removals)
+    except (ValueError, EnvironmentError), error:
+        logging.critical('%s', error)
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -30,8 +30,35 @@ import os
 import stat
 import hashlib
 import logging
+import json
+import tempfile
+import multiprocessing
+from collections import deque
+from itertools import chain
+from multiprocessing.pool import ThreadPool
 from optparse import OptionParser
 
+try:
+    from scandir import scandir
+except ImportError:
+    scandir = None
+
+# Size of the blocks read while hashing a file
+CHUNK_SIZE = 64 * 1024
+
+# Number of files being hashed ahead of the output, per worker thread
+QUEUE_DEPTH = 4
+
+# Bytes read from each end of a file to fingerprint it for the digest cache
+FINGERPRINT_SIZE = 4096
+
+# Archive members up to this size are read into memory and hashed by the
+# thread pool, bigger ones are hashed as they are read
+MEMBER_BUFFER_SIZE = 1024 * 1024
+
+# Maximum number of entries kept by the digest cache
+CACHE_ENTRIES = 20000
+
 
 def create_parser():
     '''Creates the option parser.
@@ -75,10 +102,35 @@ def create_parser():
     parser.add_option('-p', '--prefix', dest='prefix',
                       help='Add prefix argument to filename',
                       action='store', type='string')
+    parser.add_option('-j', '--jobs', dest='jobs',
+                      help='Number of files hashed in parallel. '
+                           'Defaults to the number of CPUs',
+                      action='store', type='int')
+
+    parser.add_option('-C', '--cache', dest='cache',
+                      help='Reuse the digests stored in this cache file',
+                      action='store', type='string')
+    parser.add_option('--cache-size', dest='cache_size',
+                      help='Maximum number of entries in the cache file',
+                      action='store', type='int')
+
+    parser.add_option('--files-from', dest='files_from',
+                      help='Read the filenames from this file, - for stdin',
+                      action='store', type='string')
+    parser.add_option('-0', '--null', dest='null',
+                      help='Filenames read with --files-from are separated '
+                           'by NUL characters instead of newlines',
+                      action='store_true')
+    parser.add_option('-w', '--walk', dest='walk',
+                      help='Process the files below this directory. '
+                           'Can be given more than once',
+                      action='append', type='string')
 
     parser.set_defaults(verbose=False, filename=False, no_exebit=False,
                         relative=True, no_links=True, scripts=True,
-                        sourceid='', prefix='', all=False)
+                        sourceid='', prefix='', all=False, jobs=None,
+                        cache=None, cache_size=CACHE_ENTRIES,
+                        files_from=None, null=False, walk=[])
 
     return parser
 
@@ -86,19 +138,260 @@ def create_parser():
 def parse_args(argv=None):
     '''Define command line arguments and parse sys.argv.'''
     if argv is None:
-        argv = sys.argv
+        argv = sys.argv[1:]
 
     parser = create_parser()
 
     return parser.parse_args(argv)
 
 
+def digest_stream(handle, algorithm=hashlib.sha1, head=''):
+    '''Calculates SHA1 hex digest of the data read from a file object,
+    after the data already read from it, head'''
+    calc = algorithm(head)
+    while True:
+        chunk = handle.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        calc.update(chunk)
+    return calc.hexdigest(), calc.digest_size
+
+
 def calculate_hash(filename, algorithm=hashlib.sha1):
     '''Calculates SHA1 hex digest for a given file'''
-    calc = algorithm()
-    with open(filename, 'r') as handle:
-        calc.update(handle.read())
-        return calc.hexdigest(), calc.digest_size
+    with open(filename, 'rb') as handle:
+        return digest_stream(handle, algorithm)
+
+
+def map_ordered(function, items, jobs=None):
+    '''Calls function on each item using a pool of threads.
+
+    Yields the results in the same order as items, regardless of the order
+    the calls finish. At most a few items per thread are processed ahead of
+    the consumer, and items is read as lazily.
+    '''
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+
+    if jobs <= 1:
+        for item in items:
+            yield function(item)
+        return
+
+    pool = ThreadPool(jobs)
+    pending = deque()
+
+    try:
+        for item in items:
+            pending.append(pool.apply_async(function, (item,)))
+            if len(pending) >= jobs * QUEUE_DEPTH:
+                yield pending.popleft().get()
+
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def hash_files(filenames, jobs=None, algorithm=hashlib.sha1):
+    '''Hashes the given files using a pool of threads.
+
+    Yields (filename, hex digest, digest size) tuples in the same order as
+    filenames, regardless of the order the hashes finish.
+    '''
+    def hash_file(filename):
+        return (filename,) + calculate_hash(filename, algorithm)
+
+    return map_ordered(hash_file, filenames, jobs)
+
+
+def list_directory(path):
+    '''Returns the (path, is directory, is symlink) of the entries of a
+    directory. Uses scandir if installed, which saves the stat calls on most
+    file systems.'''
+    if scandir is not None:
+        entries = []
+        for entry in scandir(path):
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            entries.append((entry.path, is_dir, entry.is_symlink()))
+        return entries
+
+    entries = []
+    for name in os.listdir(path):
+        entry_path = os.path.join(path, name)
+        entries.append((entry_path, os.path.isdir(entry_path), os.path.islink(entry_path)))
+    return entries
+
+
+def walk(top, exclude=()):
+    '''Yields the paths of the files below the directory top, joined to it.
+
+    Files come in the order of os.walk: the ones of a directory, then the
+    ones below each of its subdirectories. Like os.walk, symlinks to
+    directories are neither listed nor followed and unreadable directories
+    are skipped. The directories in exclude aren't entered.
+    '''
+    try:
+        entries = list_directory(top)
+    except OSError:
+        return
+
+    subdirs = []
+    for path, is_dir, is_link in entries:
+        if not is_dir:
+            yield path
+        elif not is_link and path not in exclude:
+            subdirs.append(path)
+
+    for path in subdirs:
+        for filename in walk(path, exclude):
+            yield filename
+
+
+def read_filenames(handle, separator='\n'):
+    '''Yields the filenames listed in the open file handle, as they are
+    read. Empty names are skipped.'''
+    pending = ''
+    while True:
+        chunk = handle.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        names = (pending + chunk).split(separator)
+        pending = names.pop()
+        for name in names:
+            if name:
+                yield name
+
+    if pending:
+        yield pending
+
+
+class DigestCache(object):
+    '''On-disk cache of file digests.
+
+    Entries are keyed by the filename as given and are only reused while the
+    size, modification time and fingerprint (a hash of the first and last
+    blocks) of the file match. The least recently used entries are evicted
+    when the cache is saved with more than max_entries.
+
+    Digests can also be remembered by identity alone, without a filename,
+    for the files known to be copied to the ones looked up later. These
+    aren't saved.
+    '''
+
+    version = 1
+
+    def __init__(self, filename, max_entries=CACHE_ENTRIES):
+        self.filename = filename
+        self.max_entries = max_entries
+        self.entries = {}
+        self.clock = 0
+        self.dirty = False
+        self.known = {}
+
+        self.load()
+
+    def load(self):
+        '''Loads the cache file, starting empty if it is missing or invalid'''
+        try:
+            with open(self.filename, 'rb') as handle:
+                data = json.load(handle)
+            if data.get('version') == self.version:
+                self.entries = data['entries']
+                self.clock = data['clock']
+        except (IOError, ValueError, KeyError, AttributeError):
+            self.entries = {}
+
+    def save(self):
+        '''Evicts the least recently used entries and writes the cache file'''
+        if not self.dirty:
+            return
+
+        if len(self.entries) > self.max_entries:
+            by_use = sorted(self.entries, key=lambda name: self.entries[name][-1])
+            for name in by_use[:len(self.entries) - self.max_entries]:
+                del self.entries[name]
+
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            tempfd, tempname = tempfile.mkstemp(dir=directory)
+            with os.fdopen(tempfd, 'wb') as handle:
+                json.dump({'version': self.version, 'clock': self.clock,
+                           'entries': self.entries}, handle)
+            os.rename(tempname, self.filename)
+        except (IOError, OSError), error:
+            logging.warning('Failed to save digest cache %s: %s', self.filename, error)
+            return
+
+        self.dirty = False
+
+    def clear(self):
+        '''Drops all the entries'''
+        self.entries = {}
+        self.dirty = True
+
+    def invalidate(self, filename):
+        '''Drops the entry of a single file'''
+        if self.entries.pop(filename, None) is not None:
+            self.dirty = True
+
+    @staticmethod
+    def identity(filename):
+        '''Returns the (size, mtime in ns, fingerprint) of the file'''
+        statinfo = os.stat(filename)
+        calc = hashlib.sha1()
+        with open(filename, 'rb') as handle:
+            calc.update(handle.read(FINGERPRINT_SIZE))
+            if statinfo.st_size > 2 * FINGERPRINT_SIZE:
+                handle.seek(-FINGERPRINT_SIZE, os.SEEK_END)
+            calc.update(handle.read(FINGERPRINT_SIZE))
+
+        return [statinfo.st_size, int(statinfo.st_mtime * 1e9), calc.hexdigest()]
+
+    @staticmethod
+    def member_identity(size, mtime, head):
+        '''Returns the (size, mtime in seconds, fingerprint) of an archive
+        member, from the first FINGERPRINT_SIZE bytes of its data. Archives
+        only keep whole seconds of modification times.'''
+        return [size, int(mtime), hashlib.sha1(head).hexdigest()]
+
+    @staticmethod
+    def source_identity(filename):
+        '''Returns the member_identity the file gets once archived'''
+        statinfo = os.stat(filename)
+        with open(filename, 'rb') as handle:
+            return DigestCache.member_identity(statinfo.st_size, statinfo.st_mtime,
+                                               handle.read(FINGERPRINT_SIZE))
+
+    def remember(self, identity, digest, size):
+        '''Remembers the digest of any file looked up with identity'''
+        self.known[tuple(identity)] = (digest, size)
+
+    def lookup(self, filename, identity):
+        '''Returns the cached (digest, size) of the file or None'''
+        entry = self.entries.get(filename)
+        if entry is None or entry[:3] != identity:
+            known = self.known.get(tuple(identity))
+            if known is not None:
+                self.store(filename, identity, *known)
+            return known
+
+        self.clock += 1
+        entry[-1] = self.clock
+        self.dirty = True
+        return entry[3], entry[4]
+
+    def store(self, filename, identity, digest, size):
+        '''Stores the digest of the file with the given identity'''
+        self.clock += 1
+        self.entries[filename] = identity + [digest, size, self.clock]
+        self.dirty = True
 
 
 def format_pathname(filename, options):
@@ -129,12 +422,18 @@ def format_pathname(filename, options):
 
 def format_output(filename, digest, size, options):
     '''Returns the formatted line to be printed'''
-    line = ''
-
     if not os.path.exists(filename):
         logging.error("Can't open file %s; exiting.", filename)
         sys.exit(1)
 
+    return format_line(filename, digest, size, options)
+
+
+def format_line(filename, digest, size, options):
+    '''Returns the signature line of filename, which doesn't need to exist,
+    given its digest'''
+    line = ''
+
     # Source id. Still not used.
     if options.sourceid:
         line += 'S %d %s ' % (len(options.sourceid), options.sourceid)
@@ -146,21 +445,179 @@ def format_output(filename, digest, size, options):
     return line
 
 
-def process_file(filename, options, stream=sys.stdout):
-    '''Process a single filename print its formatted signature line.'''
+def should_process(filename, options):
+    '''Checks if the file gets a signature line, given the options
+    'no_links' and 'no_exebit'.'''
 
     if options.no_links:
         statinfo = os.lstat(filename)
-        if stat.S_ISLNK(statinfo.st_mode) or stat.S_ISDIR(statinfo.st_mode):
-            return 0
+        if stat.S_ISLNK(statinfo.st_mode):
+            return False
+    else:
+        statinfo = os.stat(filename)
+
+    if stat.S_ISDIR(statinfo.st_mode):
+        return False
 
     if not options.no_exebit:
 
         mode = stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH
 
         if not mode & stat.S_IMODE(statinfo.st_mode):
-            return 0
+            return False
+
+    return True
+
+
+def tar_members(tar):
+    '''Yields the (tarfile.TarInfo, file object or None) of each member of
+    the open tarfile.TarFile, in archive order. Regular files come with a
+    file object, which must be read before the next member, as the archive
+    can be a stream.'''
+    for info in tar:
+        yield info, tar.extractfile(info) if info.isfile() else None
+
+
+def archive_path(name):
+    '''Returns the normalized path of a tar member name'''
+    return os.path.normpath(name.lstrip('/'))
+
+
+def generate_member_lines(members, options, cache=None):
+    '''Yields the signature lines of the files of a tar archive, as
+    (tarfile.TarInfo, file object) pairs like the ones of tar_members.
 
+    The lines are the ones process_files gives for the extracted archive,
+    in archive order. Regular files follow the execute bit rules of
+    should_process and are hashed by 'options.jobs' threads while the
+    archive is read. If a DigestCache is given, the files matching the
+    entry of their signature path are not hashed. Hard links reuse the
+    digest of their target. Symbolic links, when processed, get the line of
+    the file they point to after the other lines; links leaving the archive
+    are skipped.
+    '''
+    exebits = stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH
+    # Paths of the files and directories of the archive, and digests of the
+    # processed files
+    paths = set()
+    digests = {}
+    symlinks = []
+
+    def resolve(path, links):
+        for _ in range(40):
+            if path not in links:
+                return path
+            target = links[path]
+            if target.startswith('/'):
+                path = archive_path(target)
+            else:
+                path = os.path.normpath(os.path.join(os.path.dirname(path), target))
+        return None
+
+    def selected():
+        # Reads every member before the next one, as required by streams
+        for info, handle in members:
+            path = archive_path(info.name)
+            if not info.issym():
+                paths.add(path)
+
+            if info.isfile():
+                if not (options.no_exebit or info.mode & exebits):
+                    continue
+
+                head = handle.read(FINGERPRINT_SIZE)
+                identity, cached, data = None, None, None
+                if cache is not None:
+                    identity = DigestCache.member_identity(info.size, info.mtime, head)
+                    cached = cache.lookup(format_pathname(info.name, options), identity)
+
+                if cached is None and info.size > MEMBER_BUFFER_SIZE:
+                    digest = digest_stream(handle, head=head)
+                elif cached is None:
+                    digest, data = None, head + handle.read()
+                else:
+                    digest = cached
+                yield info, path, identity, cached, digest, data
+
+            elif info.islnk():
+                yield info, path, None, None, None, None
+
+            elif info.issym() and not options.no_links:
+                symlinks.append((info, path))
+
+    def hash_entry(entry):
+        info, path, identity, cached, digest, data = entry
+        if data is not None:
+            calc = hashlib.sha1(data)
+            digest = calc.hexdigest(), calc.digest_size
+        return info, path, identity, cached, digest
+
+    for info, path, identity, cached, digest in map_ordered(hash_entry, selected(),
+                                                             options.jobs):
+        if info.islnk():
+            digest = digests.get(archive_path(info.linkname))
+            if digest is None:
+                continue
+        elif cached is None and cache is not None:
+            cache.store(format_pathname(info.name, options), identity, *digest)
+
+        digests[path] = digest
+        logging.debug('Processed file: %s', info.name)
+        yield format_line(info.name, digest[0], digest[1], options)
+
+    # Links can point to files stored after them
+    links = dict((path, info.linkname) for info, path in symlinks)
+    for info, path in symlinks:
+        target = resolve(path, links)
+        if target in digests:
+            logging.debug('Processed file: %s', info.name)
+            yield format_line(info.name, digests[target][0], digests[target][1], options)
+        elif target not in paths:
+            logging.warning("Skipping %s, its target isn't a file of the archive", info.name)
+
+
+def generate_lines(filenames, options, cache=None):
+    '''Yields the signature lines of the filenames, in order.
+
+    filenames can be any iterable, which is read as the files are hashed in
+    parallel by 'options.jobs' threads, so lines come out before the last
+    filename is known. If a DigestCache is given, only the files not
+    matching their cache entries are hashed.
+    '''
+    def selected():
+        for filename in filenames:
+            if not should_process(filename, options):
+                continue
+
+            identity, cached = None, None
+            if cache is not None:
+                identity = DigestCache.identity(filename)
+                cached = cache.lookup(filename, identity)
+            yield filename, identity, cached
+
+    def digest(entry):
+        filename, identity, cached = entry
+        return filename, identity, cached, cached or calculate_hash(filename)
+
+    for filename, identity, cached, (digest, size) in map_ordered(digest, selected(),
+                                                                  options.jobs):
+        if cached is None and cache is not None:
+            cache.store(filename, identity, digest, size)
+
+        logging.debug('Processed file: %s', filename)
+        yield format_output(filename, digest, size, options)
+
+
+def process_files(filenames, options, stream=sys.stdout, cache=None):
+    '''Process the filenames, printing their signature lines in order.'''
+    for line in generate_lines(filenames, options, cache):
+        stream.write(line + '\n')
+
+
+def process_file(filename, options, stream=sys.stdout):
+    '''Process a single filename print its formatted signature line.'''
+
+    if should_process(filename, options):
         digest, size = calculate_hash(filename)
         stream.write(format_output(filename, digest, size, options) + '\n')
 
@@ -172,12 +629,37 @@ def main():
     if options.verbose:
         logging.basicConfig(level=logging.DEBUG)
 
-    # TODO Add option to read filenames from a text file.
-    # Currently we just support reading files from command line
+    cache = None
+    if options.cache:
+        cache = DigestCache(options.cache, options.cache_size)
+
+    sources = []
     if options.filename:
-        for filename in args:
-            logging.debug('Processing file: %s', filename)
-            process_file(filename, options)
+        sources.append(args)
+
+    handle = None
+    if options.files_from == '-':
+        handle = sys.stdin
+    elif options.files_from:
+        try:
+            handle = open(options.files_from, 'rb')
+        except IOError, error:
+            logging.error("Can't open %s: %s", options.files_from, error.strerror)
+            sys.exit(1)
+    if handle is not None:
+        sources.append(read_filenames(handle, '\0' if options.null else '\n'))
+
+    for top in options.walk:
+        sources.append(walk(top))
+
+    try:
+        process_files(chain(*sources), options, cache=cache)
+    finally:
+        if handle not in (None, sys.stdin):
+            handle.close()
+
+    if cache is not None:
+        cache.save()
 
 
 if __name__ == '__main__':
@@ -48,7 +48,8 @@ setup(name="pyside-assistant",
                 ('share/psa/templates/ubuntu-qtgui',
                         glob.glob('templates/ubuntu-qtgui/*.template') +
                         ['templates/ubuntu-qtgui/template.cfg']),
-                ('share/psa/scripts', ['scripts/refhashmake.py', 'scripts/deb_add.py']),
+                ('share/psa/scripts', ['scripts/refhashmake.py', 'scripts/deb_add.py',
+                                       'scripts/arfile.py']),
             ],
             version='0.1.0',
             maintainer="Bruno Araujo",
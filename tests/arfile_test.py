@@ -0,0 +1,100 @@
+'''Unit tests for the arfile module'''
+
+import unittest
+import shutil
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'scripts'))
+import arfile
+
+
+class ArFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix='psatemp')
+        self.archive = os.path.join(self.path, 'test.a')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def createArchive(self, members):
+        '''Writes an archive with the (header name, data) members'''
+        with open(self.archive, 'wb') as handle:
+            handle.write(arfile.AR_MAGIC)
+            for name, data in members:
+                handle.write('%-16s%-12s%-6s%-6s%-8s%-10s`\n' %
+                             (name, 1300000000, 0, 0, 100755, len(data)))
+                handle.write(data)
+                if len(data) & 1:
+                    handle.write('\n')
+
+    def testIndex(self):
+        self.createArchive([('debian-binary', '2.0\n'),
+                            ('control.tar.gz', 'odd'),
+                            ('data.tar.gz/', 'data')])
+
+        with arfile.ArFile(self.archive) as archive:
+            self.assertEqual(archive.getnames(),
+                             ['debian-binary', 'control.tar.gz', 'data.tar.gz'])
+
+            member = archive.getmember('control.tar.gz')
+            self.assertEqual(member.size, 3)
+            self.assertEqual(member.mtime, 1300000000)
+            self.assertEqual(member.mode, 0100755)
+
+            # Odd sized members are padded
+            self.assertEqual(str(archive.read('data.tar.gz')), 'data')
+            self.assertEqual(archive.find('data.tar').name, 'data.tar.gz')
+            self.assertEqual(archive.find('_aegis'), None)
+
+    def testLongNames(self):
+        self.createArchive([('//', 'a-very-long-member-name/\nanother-long-member-name/\n'),
+                            ('/0', 'first'),
+                            ('/25', 'second'),
+                            ('short/', 'third')])
+
+        with arfile.ArFile(self.archive) as archive:
+            self.assertEqual(archive.getnames(),
+                             ['a-very-long-member-name', 'another-long-member-name', 'short'])
+            self.assertEqual(str(archive.read('another-long-member-name')), 'second')
+            self.assertEqual(len(archive.entries), 4)
+
+    def testOpen(self):
+        self.createArchive([('first', 'abc'), ('second', 'defgh')])
+
+        with arfile.ArFile(self.archive) as archive:
+            member = archive.open('second')
+            self.assertEqual(member.read(2), 'de')
+            member.seek(1)
+            self.assertEqual(member.read(), 'efgh')
+            self.assertEqual(member.tell(), 5)
+            self.assertEqual(member.read(), '')
+
+    def testBadArchive(self):
+        with open(self.archive, 'wb') as handle:
+            handle.write('not an archive')
+
+        self.assertRaises(ValueError, arfile.ArFile, self.archive)
+        self.assertFalse(arfile.is_arfile(self.archive))
+
+        self.createArchive([('truncated', 'data')])
+        with open(self.archive, 'r+b') as handle:
+            handle.truncate(os.path.getsize(self.archive) - 1)
+
+        self.assertRaises(ValueError, arfile.ArFile, self.archive)
+
+    def testExtract(self):
+        self.createArchive([('first', 'abc'), ('second', 'defgh')])
+
+        arfile.extract(self.archive, targetdir=self.path)
+
+        with open(os.path.join(self.path, 'second'), 'rb') as handle:
+            self.assertEqual(handle.read(), 'defgh')
+        self.assertEqual(arfile.get_members(self.archive), ['first', 'second'])
+
+
+if __name__ == "__main__":
+    unittest.main()
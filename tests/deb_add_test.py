@@ -0,0 +1,124 @@
+'''Unit tests for the deb_add script'''
+
+import unittest
+import shutil
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'scripts'))
+import arfile
+import deb_add
+
+
+class DebAddTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix='psatemp')
+        self.control = os.path.join(self.path, 'control')
+        with open(self.control, 'w') as handle:
+            handle.write('Package: foo\nVersion: 0.1.0-1\nArchitecture: all\n')
+
+        self.debfile = os.path.join(self.path, 'foo_0.1.0-1_all.deb')
+        with open(self.debfile, 'wb') as handle:
+            handle.write(deb_add.AR_MAGIC)
+            for name, data in [('debian-binary', '2.0\n'),
+                               ('control.tar.gz', 'control'),
+                               ('data.tar.gz', 'x' * (3 * deb_add.BUFFER_SIZE + 1))]:
+                handle.write('%-16s%-12s%-6s%-6s%-8s%-10s`\n' %
+                             (name, 0, 0, 0, 100644, len(data)))
+                handle.write(data)
+                if len(data) & 1:
+                    handle.write('\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def createFile(self, filename, data):
+        abs_filename = os.path.join(self.path, filename)
+        with open(abs_filename, 'wb') as handle:
+            handle.write(data)
+        return abs_filename
+
+    def member(self, name):
+        targetdir = tempfile.mkdtemp(dir=self.path)
+        arfile.extract(self.debfile, name, targetdir)
+        with open(os.path.join(targetdir, name), 'rb') as handle:
+            return handle.read()
+
+    def testAppend(self):
+        with open(self.debfile, 'rb') as handle:
+            original = handle.read()
+
+        deb_add.add(self.createFile('credentials', 'aegis'), '_aegis',
+                    self.control, self.debfile)
+
+        with open(self.debfile, 'rb') as handle:
+            data = handle.read()
+
+        # The existing members are left untouched
+        self.assertEqual(data[:len(original)], original)
+        self.assertFalse(os.path.exists(self.debfile + '.orig'))
+        self.assertEqual(self.member('_aegis'), 'aegis')
+
+    def testFailedAppend(self):
+        with open(self.debfile, 'rb') as handle:
+            original = handle.read()
+
+        def add_files(newdeb, files):
+            newdeb.write('partial member')
+            raise IOError('No space left on device')
+
+        write = deb_add.add_files
+        deb_add.add_files = add_files
+        try:
+            self.assertRaises(IOError, deb_add.apply_changes, self.debfile,
+                              [(self.createFile('credentials', 'aegis'), '_aegis')])
+        finally:
+            deb_add.add_files = write
+
+        with open(self.debfile, 'rb') as handle:
+            self.assertEqual(handle.read(), original)
+        self.assertEqual(sorted(os.listdir(self.path)),
+                         ['control', 'credentials', 'foo_0.1.0-1_all.deb'])
+
+    def testReplace(self):
+        deb_add.add(self.createFile('control.tar.gz', 'new control'), 'control.tar.gz',
+                    self.control, self.debfile)
+
+        self.assertEqual(arfile.get_members(self.debfile),
+                         ['debian-binary', 'control.tar.gz', 'data.tar.gz'])
+        self.assertEqual(self.member('control.tar.gz'), 'new control')
+        self.assertEqual(self.member('data.tar.gz'), 'x' * (3 * deb_add.BUFFER_SIZE + 1))
+
+    def testApplyChanges(self):
+        deb_add.apply_changes(self.debfile,
+                              [(self.createFile('control', 'new control'), 'control.tar.gz'),
+                               (self.createFile('credentials', 'aegis'), '_aegis'),
+                               (self.createFile('extra', 'extra'), 'extra')],
+                              removals=['data.tar.gz'])
+
+        # The package is swapped atomically, without backups or temporary files
+        self.assertEqual(sorted(os.listdir(self.path)),
+                         ['control', 'credentials', 'extra', 'foo_0.1.0-1_all.deb'])
+
+        self.assertEqual(arfile.get_members(self.debfile),
+                         ['debian-binary', 'control.tar.gz', '_aegis', 'extra'])
+        self.assertEqual(self.member('control.tar.gz'), 'new control')
+        self.assertEqual(self.member('_aegis'), 'aegis')
+
+    def testApplyChangesMissingMember(self):
+        with open(self.debfile, 'rb') as handle:
+            original = handle.read()
+
+        self.assertRaises(ValueError, deb_add.apply_changes, self.debfile,
+                          [(self.createFile('credentials', 'aegis'), '_aegis')],
+                          removals=['_missing'])
+
+        with open(self.debfile, 'rb') as handle:
+            self.assertEqual(handle.read(), original)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,14 +1,21 @@
 '''Unit tests for pyside-assistant commands'''
 
 import unittest
+import gzip
 import shutil
 import os
 import subprocess
 import sys
 import tempfile
+import time
 from contextlib import contextmanager
+from cStringIO import StringIO
 
+import json
 import tarfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'scripts'))
 import arfile
 
 @contextmanager
@@ -29,7 +36,15 @@ class PySideAssistantCommandsTest(unittest.TestCase):
         shutil.rmtree(self.path, ignore_errors=True)
         os.makedirs(self.path)
 
+        # Keep the template index out of the user cache
+        self.cache_dir = tempfile.mkdtemp(prefix='psacache')
+        self.environ = os.environ.copy()
+        os.environ['PSA_CACHE_DIR'] = self.cache_dir
+
     def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.cache_dir)
         shutil.rmtree(self.path)
 
     def runShellCommand(self, command, verbose=False):
@@ -184,6 +199,39 @@ class InitTest(PySideAssistantCommandsTest):
         self.assert_('description="a description2"' in contents)
 
 
+class InitBatchTest(PySideAssistantCommandsTest):
+
+    def testInitBatchCommand(self):
+        with open(os.path.join(self.path, 'projects.csv'), 'w') as handle:
+            handle.write('slug,template,app-name,description,section,category\n')
+            handle.write('batch1,harmattan,batch app1,a description1,games,Game\n')
+            handle.write('batch2,ubuntu-qml,batch app2\n')
+            handle.write('batch3,harmattan,batch app3,a description3,invalid\n')
+
+        command = ' '.join(['cd', self.path, ';', 'psa init-batch -j 2 projects.csv'])
+        proc = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        stdout, stderr = proc.communicate()
+
+        # The invalid row is reported without stopping the others
+        self.assertEqual(proc.returncode, 1)
+        self.assert_('batch1: created' in stdout)
+        self.assert_('batch2: created' in stdout)
+        self.assert_('batch3: error: Error: Invalid section' in stdout)
+
+        self.verifyDirectoryStructure(os.path.join(self.path, 'batch1'),
+                                      ['batch1.psa', 'batch1.aegis', 'README.assistant'])
+        self.verifyDirectoryStructure(os.path.join(self.path, 'batch2'),
+                                      ['batch2.psa', 'qml/main.qml'])
+        self.assertFalse(os.path.exists(os.path.join(self.path, 'batch3')))
+
+        f = open(os.path.join(self.path, 'batch1', 'batch1.desktop'))
+        contents = f.read()
+        f.close()
+        self.assert_('Name=batch app1' in contents)
+        self.assert_('Categories=Game;' in contents)
+
+
 class BuildTest(PySideAssistantCommandsTest):
 
 
@@ -235,6 +283,17 @@ class BuildTest(PySideAssistantCommandsTest):
         finally:
             shutil.rmtree(path)
 
+    def decompress(self, archive, member):
+        '''Returns the uncompressed contents of the package member'''
+        data = archive.read(archive.getmember(member))
+        if member.endswith('.xz'):
+            proc = subprocess.Popen(['xz', '-dc'], stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE)
+            data = proc.communicate(data)[0]
+        elif member.endswith('.gz'):
+            data = gzip.GzipFile(fileobj=StringIO(data)).read()
+        return data
+
     def base_debian_components(self):
         '''Base debian components common to all packages'''
 
@@ -319,6 +378,176 @@ class BuildTest(PySideAssistantCommandsTest):
 
         self.check_deb_contents(deb, deb_contents)
 
+    def testBuildTargets(self):
+        project = 'foobar'
+
+        path = self.init_project(project, 'ubuntu-qml')
+
+        with working_directory(path):
+            command = 'psa build-deb --targets harmattan,ubuntu-qml > /dev/null'
+            self.runShellCommand(command)
+
+        for target in ['harmattan', 'ubuntu-qml']:
+            expected_deb = os.path.join(path, 'deb_dist', target, 'deb_dist',
+                                        ('%s_0.1.0-1_all.deb' % project))
+            self.assert_(os.path.exists(expected_deb), msg="Debian file %s does not exist" % expected_deb)
+
+        deb_contents = self.base_debian_components()
+        deb_contents['control'].append('./digsigsums')
+        deb_contents['data'].append('./usr/share/icons/hicolor/64x64/apps/%s.png' % project)
+
+        self.check_deb_contents(os.path.join(path, 'deb_dist', 'harmattan', 'deb_dist',
+                                             ('%s_0.1.0-1_all.deb' % project)), deb_contents)
+
+    def testBuildAll(self):
+        projects = ['foo', 'bar']
+        for project in projects:
+            self.init_project(project, 'ubuntu-qml')
+
+        with working_directory(self.path):
+            command = 'psa build-all -j 2 > /dev/null'
+            self.runShellCommand(command)
+
+        for project in projects:
+            expected_deb = os.path.join(self.path, project, 'deb_dist',
+                                        ('%s_0.1.0-1_all.deb' % project))
+            self.assert_(os.path.exists(expected_deb), msg="Debian file %s does not exist" % expected_deb)
+            self.assert_(os.path.exists(os.path.join(self.path, project, 'psa-build.log')))
+
+    def testBuildAllFailure(self):
+        projects = ['foo', 'bar']
+        for project in projects:
+            self.init_project(project, 'ubuntu-qml')
+
+        # deb_dist can't be removed when it isn't a directory
+        with open(os.path.join(self.path, 'bar', 'deb_dist'), 'w') as handle:
+            handle.write('not a directory')
+
+        with working_directory(self.path):
+            proc = subprocess.Popen(['psa', 'build-all', '-j', '2'], stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE)
+            stdout, _ = proc.communicate()
+
+        self.assertEqual(proc.returncode, 1)
+        self.assert_('bar: failed' in stdout)
+        self.assert_('foo: ' in stdout)
+
+    def testBuildFast(self):
+        project = 'foobar'
+
+        path = self.init_project(project, 'harmattan')
+        expected_deb = os.path.join(path, 'deb_dist', ('%s_0.1.0-1_all.deb' % project))
+
+        with working_directory(path):
+            self.runShellCommand('psa build-deb --fast > /dev/null')
+            with open(expected_deb, 'rb') as handle:
+                first = handle.read()
+
+            self.runShellCommand('psa build-deb --fast --force > /dev/null')
+            with open(expected_deb, 'rb') as handle:
+                self.assertEqual(handle.read(), first)
+
+        deb_contents = self.base_debian_components()
+
+        deb_contents['control'].append('./digsigsums')
+        deb_contents['data'].append('./usr/bin/%s' % project)
+        deb_contents['data'].append('./usr/share/applications/%s.desktop' % project)
+        deb_contents['data'].append('./usr/share/icons/hicolor/64x64/apps/%s.png' % project)
+        deb_contents['data'].append('./usr/share/%s/qml/main.qml' % project)
+        deb_contents['data'].append('./usr/share/%s/qml/MainPage.qml' % project)
+
+        self.check_deb_contents(expected_deb, deb_contents)
+
+    def testBuildIncremental(self):
+        project = 'foobar'
+
+        path = self.init_project(project, 'harmattan')
+        deb = os.path.join(path, 'deb_dist', ('%s_0.1.0-1_all.deb' % project))
+        raw = deb + '.raw'
+
+        def build(options=''):
+            with working_directory(path):
+                self.runShellCommand('psa build-deb --fast %s > /dev/null' % options)
+            return os.stat(raw).st_mtime, os.stat(deb).st_mtime
+
+        def edit(filename, data):
+            with open(os.path.join(path, filename), 'ab') as handle:
+                handle.write(data)
+
+        package, postprocess = build()
+
+        # Unchanged project, both stages are skipped
+        self.assertEqual(build(), (package, postprocess))
+
+        # Forced, both stages run again
+        stamps = build('--force')
+        self.assertNotEqual(stamps[0], package)
+        self.assertNotEqual(stamps[1], postprocess)
+        package, postprocess = stamps
+
+        # A project file changed, the package is built again
+        edit('qml/main.qml', '\n// edited\n')
+        stamps = build()
+        self.assertNotEqual(stamps[0], package)
+        self.assertNotEqual(stamps[1], postprocess)
+        package, postprocess = stamps
+
+        # The credentials are only used by the post processing
+        edit(project + '.aegis', 'credentials')
+        stamps = build()
+        self.assertEqual(stamps[0], package)
+        self.assertNotEqual(stamps[1], postprocess)
+        package, postprocess = stamps
+
+        # The icon is installed by setup.py too, so the package is rebuilt
+        edit(project + '.png', '\0')
+        stamps = build()
+        self.assertNotEqual(stamps[0], package)
+        self.assertNotEqual(stamps[1], postprocess)
+
+    def testBuildFastCompression(self):
+        project = 'foobar'
+
+        path = self.init_project(project, 'harmattan')
+        expected_deb = os.path.join(path, 'deb_dist', ('%s_0.1.0-1_all.deb' % project))
+
+        for options, member in [('--compression-profile release', 'data.tar.xz'),
+                                ('--compression none', 'data.tar'),
+                                ('--compression-profile dev', 'data.tar.gz')]:
+            with working_directory(path):
+                self.runShellCommand('psa build-deb --fast %s > /dev/null' % options)
+
+            archive = arfile.ArFile(expected_deb)
+            try:
+                self.assertEqual(archive.getnames(),
+                                 ['debian-binary', 'control.tar.gz', member])
+                data = tarfile.open(fileobj=StringIO(self.decompress(archive, member)))
+                self.assertTrue(data.getmember('./usr/bin/%s' % project))
+            finally:
+                archive.close()
+
+    def testBuildProfile(self):
+        project = 'foobar'
+
+        path = self.init_project(project, 'ubuntu-qml')
+
+        with working_directory(path):
+            for _ in range(2):
+                command = 'psa build-deb --force --profile > /dev/null'
+                self.runShellCommand(command)
+
+            command = 'psa stats > /dev/null'
+            self.runShellCommand(command)
+
+        with open(os.path.join(path, 'deb_dist', 'psa-profile.json')) as handle:
+            report = json.load(handle)
+        self.assertEqual(report['status'], 'ok')
+        names = [stage['name'] for stage in report['stages']]
+        self.assert_('execute_build/package/dpkg-buildpackage' in names)
+
+        with open(os.path.join(path, '.psa-history')) as handle:
+            self.assertEqual(len(handle.readlines()), 2)
+
 class UpdateTest(PySideAssistantCommandsTest):
 
     def testUpdateCommand(self):
@@ -364,6 +593,74 @@ class UpdateTest(PySideAssistantCommandsTest):
         f.close()
         self.assert_('description="a description2"' in contents)
 
+    def testUpdateCommandFiles(self):
+        command = ' '.join(['cd', self.path, ';', 'psa init testproject harmattan > /dev/null'])
+        self.runShellCommand(command)
+
+        command = ' '.join(['cd', os.path.join(self.path,'testproject'), ';', 'psa update -a "Name=app" -c "Game" -d \'say "hi"\' > /dev/null'])
+        self.runShellCommand(command)
+
+        project_path = os.path.join(self.path, 'testproject')
+        self.verifyDirectoryStructure(project_path, ['testproject.desktop.old', 'setup.py.old',
+                                                     'testproject.psa.old'])
+        self.assertFalse(os.path.exists(os.path.join(project_path, 'stdeb.cfg.old')))
+
+        f = open(os.path.join(project_path, 'testproject.desktop'))
+        contents = f.read()
+        f.close()
+        self.assert_('\nName=Name=app\n' in contents)
+        self.assert_('Categories=Game;' in contents)
+        self.assert_('Exec=invoker --single-instance --type=e /usr/bin/testproject' in contents)
+
+        f = open(os.path.join(project_path, 'setup.py'))
+        contents = f.read()
+        f.close()
+        self.assert_('description="say \\"hi\\"",' in contents)
+
+        f = open(os.path.join(project_path, 'testproject.psa'))
+        contents = f.read()
+        f.close()
+        self.assert_('appname = Name=app' in contents)
+        self.assert_('category = Game' in contents)
+
+class WatchTest(PySideAssistantCommandsTest):
+
+    def wait_for(self, condition, timeout=30):
+        deadline = time.time() + timeout
+        while not condition():
+            if time.time() > deadline:
+                self.fail('Timed out waiting for the watch command')
+            time.sleep(0.1)
+
+    def testWatchCommand(self):
+        command = ' '.join(['cd', self.path, ';', 'psa init testproject harmattan > /dev/null'])
+        self.runShellCommand(command)
+
+        project_path = os.path.join(self.path, 'testproject')
+        expected_deb = os.path.join(project_path, 'deb_dist', 'testproject_0.1.0-1_all.deb')
+
+        with open(os.devnull, 'w') as devnull:
+            proc = subprocess.Popen(['psa', 'watch', '--fast', '-i', '0.1', '-d', '0.2'],
+                                    cwd=project_path, stdout=devnull, stderr=devnull)
+        try:
+            self.wait_for(lambda: os.path.exists(expected_deb))
+            built = os.stat(expected_deb).st_mtime
+
+            psa_file = os.path.join(project_path, 'testproject.psa')
+            with open(psa_file) as f:
+                contents = f.read()
+            with open(psa_file, 'w') as f:
+                f.write(contents.replace('appname = PySide app', 'appname = watched app'))
+
+            def desktop_updated():
+                with open(os.path.join(project_path, 'testproject.desktop')) as f:
+                    return 'Name=watched app' in f.read()
+            self.wait_for(desktop_updated)
+            self.wait_for(lambda: os.path.exists(expected_deb) and
+                                  os.stat(expected_deb).st_mtime != built)
+        finally:
+            proc.terminate()
+            proc.wait()
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,276 @@
+'''Unit tests for the internals of the psa script'''
+
+import unittest
+import errno
+import fcntl
+import imp
+import optparse
+import shutil
+import os
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+
+PSA = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'psa')
+
+
+def load_psa():
+    '''Loads the psa script as a module, without writing a compiled file'''
+    dont_write_bytecode = sys.dont_write_bytecode
+    sys.dont_write_bytecode = True
+    try:
+        return imp.load_source('psa', PSA)
+    finally:
+        sys.dont_write_bytecode = dont_write_bytecode
+
+psa = load_psa()
+
+
+class PsaTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix='psatemp')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def createFile(self, filename, data, mode=0644):
+        filename = os.path.join(self.path, filename)
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, 'wb') as handle:
+            handle.write(data)
+        os.chmod(filename, mode)
+        return filename
+
+
+class TemplateIndexTest(PsaTest):
+
+    def setUp(self):
+        PsaTest.setUp(self)
+        self.templates = os.path.join(self.path, 'templates')
+        self.index = os.path.join(self.path, 'index.json')
+        self.createFile('templates/sample/template.cfg', '[Template]\nclass: Project\n')
+        self.createFile('templates/sample/src/main.py.template', 'print "${appname}"\n')
+
+        psa.save_template_index(self.index, psa.build_template_index(self.templates))
+
+    def testValidIndex(self):
+        index = psa.load_template_index(self.index)
+        self.assertNotEqual(index, None)
+        self.assertEqual(index['templates']['sample']['digest'],
+                         psa.build_template_index(self.templates)['templates']['sample']['digest'])
+
+    def testTemplateFileEditedInPlace(self):
+        digest = psa.load_template_index(self.index)['templates']['sample']['digest']
+        filename = os.path.join(self.templates, 'sample', 'src', 'main.py.template')
+        statinfo = os.stat(filename)
+
+        # Same size and folder mtimes, only the file stamp changes
+        with open(filename, 'r+b') as handle:
+            handle.write('print "${version}"\n'[:statinfo.st_size])
+        os.utime(filename, (statinfo.st_atime, statinfo.st_mtime + 1))
+
+        self.assertEqual(psa.load_template_index(self.index), None)
+
+        index = psa.build_template_index(self.templates)
+        self.assertNotEqual(index['templates']['sample']['digest'], digest)
+
+
+class SetupReaderTest(PsaTest):
+
+    def testReadArguments(self):
+        self.createFile('setup.py', 'from distutils.core import setup\n'
+                        'setup(name="sample", long_description=read("sample.longdesc"),\n'
+                        '      data_files=[("share", glob.glob("qml/*.qml"))])\n')
+        self.createFile('sample.longdesc', 'Sample project')
+        self.createFile('qml/main.qml', '')
+        self.createFile('qml/Page.qml', '')
+
+        current_dir = os.getcwd()
+        arguments = psa.SetupReader(self.path).read()
+
+        self.assertEqual(os.getcwd(), current_dir)
+        self.assertEqual(arguments['long_description'], 'Sample project')
+        self.assertEqual(arguments['data_files'],
+                         [['share', ['qml/Page.qml', 'qml/main.qml']]])
+
+    def testMissingReadFile(self):
+        self.createFile('setup.py', 'from distutils.core import setup\n'
+                        'setup(name="sample", long_description=read("sample.longdesc"))\n')
+
+        self.assertRaises(psa.BuildError, psa.SetupReader(self.path).read)
+
+
+class StageGraphTest(PsaTest):
+
+    def testResults(self):
+        graph = psa.StageGraph()
+        graph.add('a', lambda: 1)
+        graph.add('b', lambda: 2)
+        graph.add('sum', lambda a, b: a + b, depends=['a', 'b'])
+
+        self.assertEqual(graph.run(), {'a': 1, 'b': 2, 'sum': 3})
+
+    def testFailureSkipsDependents(self):
+        called = []
+
+        def fail():
+            raise RuntimeError('failed')
+
+        graph = psa.StageGraph()
+        graph.add('fail', fail)
+        graph.add('dependent', lambda result: called.append('dependent'), depends=['fail'])
+        graph.add('independent', lambda: called.append('independent'))
+
+        self.assertRaises(RuntimeError, graph.run)
+        self.assertEqual(called, ['independent'])
+
+    def testFirstFailureRaisedAfterOthers(self):
+        finished = []
+
+        def fail_early():
+            raise RuntimeError('early')
+
+        def fail_late():
+            time.sleep(0.2)
+            finished.append('late')
+            raise KeyError('late')
+
+        graph = psa.StageGraph()
+        graph.add('late', fail_late)
+        graph.add('early', fail_early)
+
+        try:
+            graph.run()
+        except RuntimeError, error:
+            self.assertEqual(str(error), 'early')
+        else:
+            self.fail('No exception raised')
+        self.assertEqual(finished, ['late'])
+
+    def testInvalidStages(self):
+        graph = psa.StageGraph()
+        graph.add('a', lambda: None)
+
+        self.assertRaises(ValueError, graph.add, 'a', lambda: None)
+        self.assertRaises(ValueError, graph.add, 'b', lambda a: None, depends=['missing'])
+
+
+class FailingLibc(object):
+    '''C library whose copy calls fail, after copying the given number of
+    bytes with sendfile'''
+
+    def __init__(self, copied=0):
+        self.copied = copied
+
+    def copy_file_range(self, source_fd, source_offset, target_fd, target_offset,
+                        count, flags):
+        return -1
+
+    def sendfile(self, target_fd, source_fd, offset, count):
+        if not self.copied:
+            return -1
+        data = os.read(source_fd, min(count, self.copied))
+        self.copied -= len(data)
+        return os.write(target_fd, data)
+
+
+class CloneFileTest(PsaTest):
+
+    def setUp(self):
+        PsaTest.setUp(self)
+        self.libc = psa.LIBC
+        self.ioctl = fcntl.ioctl
+
+        def ioctl(*args):
+            raise IOError(errno.EOPNOTSUPP, 'Operation not supported')
+        fcntl.ioctl = ioctl
+
+        self.data = ''.join(chr(index % 251) for index in range(psa.COPY_BUFSIZE * 5 / 2))
+        self.source = self.createFile('source', self.data, 0750)
+        self.target = os.path.join(self.path, 'target')
+
+    def tearDown(self):
+        psa.LIBC = self.libc
+        fcntl.ioctl = self.ioctl
+        PsaTest.tearDown(self)
+
+    def checkCopy(self):
+        with open(self.target, 'rb') as handle:
+            self.assertEqual(handle.read(), self.data)
+        self.assertEqual(stat.S_IMODE(os.stat(self.target).st_mode), 0750)
+
+    def testBufferedFallback(self):
+        psa.LIBC = FailingLibc()
+        psa.clone_file(self.source, self.target)
+        self.checkCopy()
+
+    def testPartialKernelCopy(self):
+        psa.LIBC = FailingLibc(copied=psa.COPY_BUFSIZE + 1)
+        psa.clone_file(self.source, self.target)
+        self.checkCopy()
+
+
+class CompressionPolicyTest(PsaTest):
+
+    def policy(self, profile=None, compression=None):
+        options, _ = optparse.OptionParser().parse_args([])
+        options.compression_profile = profile
+        options.compression = compression
+        return psa.CompressionPolicy.from_options(options)
+
+    def testOptions(self):
+        self.assertEqual(str(self.policy()), 'default')
+        self.assertEqual(str(self.policy('release')), 'xz:6')
+        self.assertEqual(str(self.policy('release', 'gzip')), 'gzip:9')
+        self.assertEqual(str(self.policy(compression='none')), 'none:0')
+
+    def testInvalidOptions(self):
+        self.assertRaises(psa.BuildError, self.policy, 'unknown')
+        self.assertRaises(psa.BuildError, self.policy, compression='bzip2')
+        self.assertRaises(psa.BuildError, self.policy, compression='gzip:10')
+        self.assertRaises(psa.BuildError, self.policy, compression='none:3')
+
+
+class BuildProfilerTest(PsaTest):
+
+    def testReport(self):
+        profiler = psa.BuildProfiler(enabled=True)
+        with profiler.stage('build'):
+            with profiler.stage('package'):
+                subprocess.call(['true'])
+
+        report = profiler.report(project='sample')
+        self.assertEqual(report['project'], 'sample')
+        self.assertEqual([stage['name'] for stage in report['stages']],
+                         ['build', 'build/package'])
+        self.assertTrue('children_maxrss' in report)
+        for stage in report['stages']:
+            self.assertFalse('children_maxrss' in stage)
+
+
+class BuildProjectTest(PsaTest):
+
+    def testUnremovableDirectory(self):
+        filename = self.createFile('deb_dist', 'not a directory')
+        self.assertRaises(psa.BuildError, psa.remove_directory, filename)
+
+    def testExitIsReported(self):
+        def load_project(path):
+            sys.exit(1)
+
+        original = psa.load_project
+        psa.load_project = load_project
+        try:
+            result = psa.build_project(self.path, ['build-deb'])
+        finally:
+            psa.load_project = original
+
+        self.assertEqual(result[:2], (self.path, 'SystemExit: 1'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,256 @@
+'''Unit tests for the refhashmake signature script'''
+
+import unittest
+import hashlib
+import shutil
+import os
+import sys
+import tarfile
+import tempfile
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'scripts'))
+import refhashmake
+
+
+class RefHashMakeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix='psatemp')
+        self.current_dir = os.getcwd()
+        os.chdir(self.path)
+
+    def tearDown(self):
+        os.chdir(self.current_dir)
+        shutil.rmtree(self.path)
+
+    def createFile(self, filename, data, mode=0755):
+        with open(filename, 'wb') as handle:
+            handle.write(data)
+        os.chmod(filename, mode)
+
+    def signatures(self, filenames, argv=None, cache=None):
+        options, _ = refhashmake.parse_args(['-r', '-f'] + (argv or []))
+        stream = StringIO()
+        refhashmake.process_files(filenames, options, stream=stream, cache=cache)
+        return stream.getvalue()
+
+
+class HashTest(RefHashMakeTest):
+
+    def testChunkedHash(self):
+        data = os.urandom(refhashmake.CHUNK_SIZE * 3 + 17)
+        self.createFile('large', data)
+
+        digest, size = refhashmake.calculate_hash('large')
+        self.assertEqual(digest, hashlib.sha1(data).hexdigest())
+        self.assertEqual(size, 20)
+
+    def testDeterministicOrder(self):
+        filenames = []
+        for index in range(50):
+            filename = 'file%02d' % index
+            self.createFile(filename, os.urandom(index * 1000))
+            filenames.append(filename)
+
+        parallel = self.signatures(filenames, ['-j', '8'])
+        serial = self.signatures(filenames, ['-j', '1'])
+
+        self.assertEqual(parallel, serial)
+        self.assertEqual([line.split()[-1] for line in parallel.splitlines()],
+                         filenames)
+
+    def testSkippedFiles(self):
+        self.createFile('script', '#!/bin/sh\n')
+        self.createFile('data', 'data', mode=0644)
+        os.symlink('script', 'link')
+        os.mkdir('folder')
+
+        output = self.signatures(['script', 'data', 'link', 'folder'])
+
+        self.assertEqual(output,
+                         'H 40 %s R 6 script\n' % hashlib.sha1('#!/bin/sh\n').hexdigest())
+
+    def testNoExebit(self):
+        self.createFile('data', 'data', mode=0644)
+
+        output = self.signatures(['data'], ['-b'])
+
+        self.assertEqual(output, 'H 40 %s R 4 data\n' % hashlib.sha1('data').hexdigest())
+
+    def testGenerateLinesIsLazy(self):
+        self.createFile('script', '#!/bin/sh\n')
+        consumed = []
+        def filenames():
+            while True:
+                consumed.append('script')
+                yield 'script'
+
+        options, _ = refhashmake.parse_args(['-r', '-j', '2'])
+        lines = refhashmake.generate_lines(filenames(), options)
+
+        self.assertEqual(lines.next(),
+                         'H 40 %s R 6 script' % hashlib.sha1('#!/bin/sh\n').hexdigest())
+        self.assert_(len(consumed) <= 2 * refhashmake.QUEUE_DEPTH + 1)
+
+
+class InputTest(RefHashMakeTest):
+
+    def testWalkOrder(self):
+        for folder in ['a', 'a/b', 'c', 'skipped']:
+            os.mkdir(folder)
+        for filename in ['top', 'a/one', 'a/b/two', 'c/three', 'skipped/four']:
+            self.createFile(filename, filename)
+        os.symlink('a', 'link')
+
+        expected = []
+        for root, dirnames, filenames in os.walk(os.curdir):
+            dirnames[:] = [name for name in dirnames if name != 'skipped']
+            expected.extend(os.path.join(root, name) for name in filenames)
+
+        self.assertEqual(list(refhashmake.walk(os.curdir, exclude=['./skipped'])), expected)
+        self.assertFalse('./link' in expected)
+
+    def testReadFilenames(self):
+        names = ['file%05d' % index for index in range(20000)]
+        data = '\0'.join(names) + '\0'
+        self.assert_(len(data) > refhashmake.CHUNK_SIZE)
+
+        self.assertEqual(list(refhashmake.read_filenames(StringIO(data), '\0')), names)
+        self.assertEqual(list(refhashmake.read_filenames(StringIO('one\n\ntwo'))),
+                         ['one', 'two'])
+
+
+class StreamTest(RefHashMakeTest):
+
+    def createArchive(self):
+        os.makedirs('tree/usr/bin')
+        os.makedirs('tree/usr/share')
+        self.createFile('tree/usr/bin/app', 'binary')
+        self.createFile('tree/usr/share/data', 'data', 0644)
+        os.link('tree/usr/bin/app', 'tree/usr/bin/app2')
+        os.symlink('../bin/app', 'tree/usr/share/link')
+        os.symlink('data', 'tree/usr/share/datalink')
+        os.symlink('../../../outside', 'tree/usr/share/broken')
+
+        with tarfile.open('data.tar', 'w') as archive:
+            archive.add('tree', arcname='.')
+
+    def streamSignatures(self, options, cache=None):
+        with tarfile.open('data.tar', 'r|') as archive:
+            return list(refhashmake.generate_member_lines(
+                refhashmake.tar_members(archive), options, cache))
+
+    def testMatchesExtractedTree(self):
+        self.createArchive()
+        filenames = ['usr/bin/app', 'usr/bin/app2', 'usr/share/data',
+                     'usr/share/link', 'usr/share/datalink']
+
+        for no_links in (True, False):
+            options, _ = refhashmake.parse_args(['-r', '-f'])
+            options.no_links = no_links
+            lines = self.streamSignatures(options)
+
+            os.chdir('tree')
+            stream = StringIO()
+            refhashmake.process_files(filenames, options, stream=stream)
+            os.chdir(self.path)
+
+            self.assertEqual(sorted(lines), sorted(stream.getvalue().splitlines()))
+            self.assertEqual(len(lines), 2 if no_links else 3)
+
+
+    def testCachedMembers(self):
+        self.createArchive()
+        self.createFile('tree/usr/bin/large', 'x' * (3 * refhashmake.FINGERPRINT_SIZE))
+        with tarfile.open('data.tar', 'w') as archive:
+            archive.add('tree', arcname='.')
+
+        options, _ = refhashmake.parse_args(['-r', '-f', '-j', '2'])
+        expected = self.streamSignatures(options)
+
+        class CountingHashlib(object):
+            '''Records the size of the data hashed at once'''
+            def __init__(self):
+                self.sizes = []
+            def sha1(self, data=''):
+                self.sizes.append(len(data))
+                return hashlib.sha1(data)
+
+        for run in range(2):
+            counter = CountingHashlib()
+            refhashmake.hashlib = counter
+            try:
+                cache = refhashmake.DigestCache('cache')
+                self.assertEqual(self.streamSignatures(options, cache), expected)
+                cache.save()
+            finally:
+                refhashmake.hashlib = hashlib
+
+            hashed_large = 3 * refhashmake.FINGERPRINT_SIZE in counter.sizes
+            # Only the first build hashes the whole files
+            self.assertEqual(hashed_large, run == 0)
+
+    def testRememberedDigests(self):
+        self.createArchive()
+        options, _ = refhashmake.parse_args(['-r', '-f'])
+        expected = self.streamSignatures(options)
+
+        cache = refhashmake.DigestCache('cache')
+        identity = refhashmake.DigestCache.source_identity('tree/usr/bin/app')
+        cache.remember(identity, 'remembered', 20)
+
+        lines = self.streamSignatures(options, cache)
+        self.assertNotEqual(lines, expected)
+        self.assertTrue(all('remembered' in line for line in lines))
+
+
+class DigestCacheTest(RefHashMakeTest):
+
+    def testCacheHit(self):
+        self.createFile('script', '#!/bin/sh\n')
+        cache = refhashmake.DigestCache('cache')
+        expected = self.signatures(['script'], cache=cache)
+        cache.save()
+
+        hashed = []
+        calculate_hash = refhashmake.calculate_hash
+        def counting_hash(filename, *args):
+            hashed.append(filename)
+            return calculate_hash(filename, *args)
+
+        refhashmake.calculate_hash = counting_hash
+        try:
+            output = self.signatures(['script'], cache=refhashmake.DigestCache('cache'))
+        finally:
+            refhashmake.calculate_hash = calculate_hash
+
+        self.assertEqual(output, expected)
+        self.assertEqual(hashed, [])
+
+    def testCacheInvalidation(self):
+        self.createFile('script', '#!/bin/sh\n')
+        cache = refhashmake.DigestCache('cache')
+        self.signatures(['script'], cache=cache)
+
+        self.createFile('script', '#!/bin/bash\n')
+        os.utime('script', (0, 0))
+
+        self.assertEqual(self.signatures(['script'], cache=cache),
+                         'H 40 %s R 6 script\n' % hashlib.sha1('#!/bin/bash\n').hexdigest())
+
+    def testEviction(self):
+        cache = refhashmake.DigestCache('cache', max_entries=2)
+        for index in range(3):
+            self.createFile('file%d' % index, str(index))
+            self.signatures(['file%d' % index], cache=cache)
+        cache.lookup('file0', refhashmake.DigestCache.identity('file0'))
+        cache.save()
+
+        self.assertEqual(sorted(refhashmake.DigestCache('cache').entries),
+                         ['file0', 'file2'])
+
+
+if __name__ == "__main__":
+    unittest.main()